@@ -4,6 +4,8 @@ import { createApp } from 'vue';
 import App from './App.vue';
 import router from './router';
 import i18n from './i18n';
+import { useHomeAssistant } from './stores/homeassistant';
+import { useRender } from './stores/render';
 import { useServer } from './stores/server';
 
 import './assets/main.css';
@@ -48,5 +50,16 @@ async function startApp() {
   }
 }
 
+// Lets the capture engine switch views of an already loaded page, with
+// fresh Home Assistant data
+window.dashboardNavigate = async (path) => {
+  const { clearCache } = useHomeAssistant();
+  const { rerender } = useRender();
+
+  clearCache();
+  await router.push(path);
+  rerender();
+};
+
 // Start the application
 startApp();
@@ -6,16 +6,50 @@ const state = reactive({
   events: [],
 });
 
+const entityError = (status, detail, entityId) => {
+  if (status === 401) {
+    return new Error(detail);
+  }
+  if (status === 404) {
+    return new Error(`Entity ${entityId} not found`);
+  }
+  if (status === 422) {
+    return new ValidationError('Configuration error', detail);
+  }
+  if (status === 502) {
+    return new Error('Could not connect to Home Assistant');
+  }
+  return new Error('Could not get entity');
+};
+
+const toEntity = (data) => ({
+  id: data.entity_id,
+  state: data.state,
+  attributes: data.attributes,
+  history: data.history,
+  lastChanged: data.last_changed,
+  lastUpdated: data.last_updated,
+});
+
+const cachedEntity = (entityId, options) => {
+  if (Object.prototype.hasOwnProperty.call(state.entities, entityId)) {
+    const entityState = state.entities[entityId];
+    if (options?.history === true && !entityState.history) {
+      console.warn(`Refetching entity state for ${entityId} (missing history)`);
+    } else {
+      console.warn(`Returning cached entity state for ${entityId}`);
+      return entityState;
+    }
+  }
+
+  return null;
+};
+
 export function useHomeAssistant() {
   const getEntity = async (entityId, options) => {
-    if (Object.prototype.hasOwnProperty.call(state.entities, entityId)) {
-      const entityState = state.entities[entityId];
-      if (options?.history === true && !entityState.history) {
-        console.warn(`Refetching entity state for ${entityId} (missing history)`);
-      } else {
-        console.warn(`Returning cached entity state for ${entityId}`);
-        return entityState;
-      }
+    const entityState = cachedEntity(entityId, options);
+    if (entityState) {
+      return entityState;
     }
 
     const fetchHistory = !!options?.history;
@@ -31,21 +65,8 @@ export function useHomeAssistant() {
     );
 
     if (!response?.ok) {
-      if (response.status === 401) {
-        const data = await response.json();
-        throw new Error(data.detail);
-      }
-      if (response.status === 404) {
-        throw new Error(`Entity ${entityId} not found`);
-      }
-      if (response.status === 422) {
-        const data = await response.json();
-        throw new ValidationError('Configuration error', data?.detail);
-      }
-      if (response.status === 502) {
-        throw new Error('Could not connect to Home Assistant');
-      }
-      throw new Error('Could not get entity');
+      const data = [401, 422].includes(response.status) ? await response.json() : {};
+      throw entityError(response.status, data.detail, entityId);
     }
 
     const data = await response.json();
@@ -54,26 +75,51 @@ export function useHomeAssistant() {
       throw new Error(data.detail);
     }
 
-    state.entities[entityId] = {
-      id: data.entity_id,
-      state: data.state,
-      attributes: data.attributes,
-      history: data.history,
-      lastChanged: data.last_changed,
-      lastUpdated: data.last_updated,
-    };
+    state.entities[entityId] = toEntity(data);
 
     return state.entities[entityId];
   };
 
   const getEntities = async (entityIds, options) => {
-    const entities = {};
+    const missingIds = entityIds.filter((entityId) => !cachedEntity(entityId, options));
+
+    if (missingIds.length > 0) {
+      const fetchHistory = !!options?.history;
+
+      console.warn(
+        `Fetching entity states for ${missingIds.join(', ')}, history=${fetchHistory}`
+      );
+
+      const response = await fetch('/api/ha/entities', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ entity_ids: missingIds, history: fetchHistory }),
+      });
+
+      console.debug(
+        `Request: ${response.url}, status=${response.status}, ok=${response.ok}`
+      );
+
+      if (!response?.ok) {
+        const data = [401, 422].includes(response.status) ? await response.json() : {};
+        throw entityError(response.status, data.detail, missingIds.join(', '));
+      }
 
-    for (const entityId of entityIds) {
-      entities[entityId] = await getEntity(entityId, options);
+      const data = await response.json();
+
+      for (const [entityId, entity] of Object.entries(data.entities)) {
+        state.entities[entityId] = toEntity(entity);
+      }
+
+      const [entityId, error] = Object.entries(data.errors)[0] || [];
+      if (error) {
+        throw entityError(error.status_code, error.detail, entityId);
+      }
     }
 
-    return entities;
+    return Object.fromEntries(
+      entityIds.map((entityId) => [entityId, state.entities[entityId]])
+    );
   };
 
   const getServiceResponse = async (domain, service, target, data) => {
@@ -118,8 +164,14 @@ export function useHomeAssistant() {
     return state.events;
   };
 
+  const clearCache = () => {
+    state.entities = {};
+    state.events = [];
+  };
+
   return {
     ...toRefs(state),
+    clearCache,
     getEntity,
     getEntities,
     getServiceResponse,
@@ -0,0 +1,96 @@
+import { nextTick, reactive, toRefs } from 'vue';
+
+const state = reactive({
+  ready: false,
+  timings: [],
+  renderKey: 0,
+});
+
+let expectedCards = 0;
+let viewStart = performance.now();
+let generation = 0;
+
+// Read by the capture engine to know when the view can be captured
+window.dashboardReady = false;
+window.dashboardTimings = null;
+
+const countCards = (components) => {
+  return (components || []).reduce((count, component) => {
+    if (Object.prototype.hasOwnProperty.call(component, 'components')) {
+      return count + countCards(component.components);
+    }
+    return count + 1;
+  }, 0);
+};
+
+const checkReady = async () => {
+  if (state.ready || state.timings.length < expectedCards) {
+    return;
+  }
+
+  const current = generation;
+
+  // Let settled cards render and be painted before signalling readiness
+  await nextTick();
+  await new Promise((resolve) => {
+    requestAnimationFrame(() => requestAnimationFrame(resolve));
+  });
+
+  if (current !== generation) {
+    return;
+  }
+
+  state.ready = true;
+  window.dashboardTimings = {
+    duration: Math.round(performance.now() - viewStart),
+    cards: state.timings.map((timing) => ({ ...timing })),
+  };
+  window.dashboardReady = true;
+
+  console.info(`View ready in ${window.dashboardTimings.duration} ms`);
+};
+
+export function useRender() {
+  const expectView = (view) => {
+    generation += 1;
+    expectedCards = countCards(view?.components);
+    viewStart = performance.now();
+    state.ready = false;
+    state.timings = [];
+    window.dashboardReady = false;
+    window.dashboardTimings = null;
+    checkReady();
+  };
+
+  const startCard = (type) => {
+    const start = performance.now();
+    const cardGeneration = generation;
+    let settled = false;
+
+    return (error) => {
+      if (settled || cardGeneration !== generation) {
+        return;
+      }
+      settled = true;
+
+      state.timings.push({
+        type,
+        status: error ? 'error' : 'loaded',
+        duration: Math.round(performance.now() - start),
+        error: error?.message || null,
+      });
+      checkReady();
+    };
+  };
+
+  // Render the current view again from scratch, e.g. when it is captured
+  // again by a page kept loaded between captures
+  const rerender = () => {
+    generation += 1;
+    window.dashboardReady = false;
+    window.dashboardTimings = null;
+    state.renderKey += 1;
+  };
+
+  return { ...toRefs(state), expectView, startCard, rerender };
+}
@@ -1,4 +1,7 @@
+import asyncio
 from contextlib import asynccontextmanager
+from email.utils import formatdate
+from time import time
 
 from fastapi import FastAPI, Depends, Request, status, HTTPException
 from fastapi.encoders import jsonable_encoder
@@ -8,28 +11,76 @@ from starlette.responses import Response
 from loguru import logger
 from pydantic import ValidationError
 
-from .dependencies import get_config, get_view
+from .dependencies import (
+    get_capture_index,
+    get_capture_scheduler,
+    get_capture_config,
+    get_config,
+    get_homeassistant_client,
+    get_state_mirror,
+    get_transcode_cache,
+    get_view,
+)
 from .logger import configure_logger
 from .models.capture import CaptureFormat
-from .models.config import Config
-from .models.server import ServerConfig
+from .models.config import CaptureConfig, CaptureVariant, Config, ViewConfig
+from .models.server import CaptureTrigger, ServerConfig
 from .models.view import View
 from .routers.api import router as api_router
 from .routers.proxy import router as proxy_router
 from .routers.static import router as static_router, templates
+from .capture import render_delta, render_variant
 from .exceptions import ConfigurationError
-from .capture import capture_screenshot
-from .util import repeat_every
+from .index import CaptureIndex, capture_name
+from .scheduler import CapturePriority, CaptureScheduler
+from .transcode import TranscodeCache, variant_key
+from .trigger import EventCaptureTrigger
+from .util import file_etag, is_not_modified, repeat_every
 
 
 server_config = ServerConfig()
 configure_logger(server_config)
+capture_trigger = EventCaptureTrigger(
+    capture_scheduler=get_capture_scheduler(),
+    debounce=server_config.capture_debounce,
+    min_interval=server_config.capture_min_interval,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await asyncio.to_thread(get_capture_index)
+
+    try:
+        state_mirror = get_state_mirror()
+    except (ValidationError, ConfigurationError) as e:
+        logger.error(
+            f"Not connecting to Home Assistant: Invalid configuration: {e}"
+        )
+        state_mirror = None
+
+    await get_capture_scheduler().start(app, state_mirror)
+
+    if server_config.capture_trigger is CaptureTrigger.events and state_mirror:
+        config = get_config()
+        capture_trigger.start(
+            config, get_views_to_capture(config), state_mirror
+        )
+
+    # The event trigger receives state changes through the mirror
+    if state_mirror and (
+        server_config.homeassistant_mirror
+        or server_config.capture_trigger is CaptureTrigger.events
+    ):
+        state_mirror.start()
+
     await capture_task()
     yield
+    await capture_trigger.stop()
+    await get_capture_scheduler().stop()
+
+    if get_homeassistant_client.cache_info().currsize:
+        await get_homeassistant_client().stop()
 
 
 app = FastAPI(
@@ -90,6 +141,19 @@ async def exception_handler(request: Request, exc: Exception) -> Response:
         )
 
 
+def get_views_to_capture(config: Config) -> list[ViewConfig]:
+    views = {view.name: view for view in config.views}
+    views_to_capture = config.server.capture_views or list(views)
+
+    for view in views_to_capture:
+        if view not in views:
+            logger.warning(
+                f"Skipping capture: Capture view '{view}' not configured"
+            )
+
+    return [views[view] for view in views_to_capture if view in views]
+
+
 @repeat_every(
     seconds=server_config.capture_interval,
     wait_first=server_config.capture_wait_first,
@@ -98,33 +162,98 @@ async def exception_handler(request: Request, exc: Exception) -> Response:
 async def capture_task() -> None:
     try:
         config = get_config()
-        views = {view.name: view for view in config.views}
     except (ValidationError, ConfigurationError) as e:
         logger.error(f"Skipping capture: Invalid configuration: {e}")
         return
 
-    views_to_capture = config.server.capture_views or [
-        view.name for view in views.values()
-    ]
+    views = get_views_to_capture(config)
+
+    if config.server.capture_trigger is CaptureTrigger.events:
+        # Periodic capture is a fallback for views not recently captured
+        capture_index = get_capture_index()
+        views = [
+            view
+            for view in views
+            if not (state := capture_index.state(view.name))
+            or time() - state.checked >= config.server.capture_interval
+        ]
 
     logger.info(
-        f"Running capture task for views: {', '.join(views_to_capture)}"
+        "Running capture task for views: {}".format(
+            ", ".join(view.name for view in views) or "(none)"
+        )
     )
 
-    for view in views_to_capture:
-        if view not in views:
-            logger.warning(
-                f"Skipping capture: Capture view '{view}' not configured"
+    results = await get_capture_scheduler().capture_views(
+        config=config, views=views
+    )
+
+    for result in results:
+        name = capture_name(result.view_name, result.profile)
+
+        if result.success:
+            logger.info(
+                "Captured view '{}' in {} s. ({})".format(
+                    name, result.duration, result.filename
+                )
             )
-            continue
+        else:
+            logger.warning(f"Capture of view '{name}' failed: {result.error}")
 
-        view = views[view]
-        target_url = f"http://localhost:{config.server.port}/{view.name}"
-        logger.info(f"Capturing view '{view.name}' from {target_url}")
-        await capture_screenshot(
-            config=config, url=target_url, view_name=view.name
+
+@app.get("/{view_name:str}.delta", summary="Show changes since a capture")
+async def show_capture_delta(
+    since: int = None,
+    profile: str = None,
+    view: View = Depends(get_view),
+    config: Config = Depends(get_config),
+    capture_config: CaptureConfig = Depends(get_capture_config),
+    capture_index: CaptureIndex = Depends(get_capture_index),
+) -> Response:
+    """
+    Regions of the latest capture that changed since the capture taken at
+    `since`, for partial display refreshes. The full frame is returned when
+    that capture is no longer available or too much has changed.
+    """
+    name = capture_name(view.name, profile)
+    capture = capture_index.latest(name, capture_config.format)
+
+    if not capture:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Capture not found for view '{view.name}'",
         )
 
+    base_path = None
+    if since and (
+        base := capture_index.find(name, since, capture_config.format)
+    ):
+        base_path = config.server.capture_path / base.filename
+
+    try:
+        content = await asyncio.to_thread(
+            render_delta,
+            capture_config,
+            config.server.capture_path / capture.filename,
+            capture.timestamp,
+            base_path if base_path and base_path.exists() else None,
+        )
+    except FileNotFoundError:
+        capture_index.remove(capture.filename)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Capture not found for view '{view.name}'",
+        )
+
+    return Response(
+        content,
+        media_type="application/octet-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Capture-Timestamp": str(capture.timestamp),
+        },
+    )
+
 
 @app.get("/{view_name:str}.{capture_format:str}", summary="Show capture")
 @app.get(
@@ -132,28 +261,128 @@ async def capture_task() -> None:
     summary="Show historic capture",
 )
 async def show_capture(
+    request: Request,
     capture_format: CaptureFormat,
     timestamp: int = None,
+    fresh: bool = False,
+    profile: str = None,
+    variant: CaptureVariant = Depends(),
     view: View = Depends(get_view),
     config: Config = Depends(get_config),
+    capture_config: CaptureConfig = Depends(get_capture_config),
+    capture_index: CaptureIndex = Depends(get_capture_index),
+    capture_scheduler: CaptureScheduler = Depends(get_capture_scheduler),
+    transcode_cache: TranscodeCache = Depends(get_transcode_cache),
 ) -> FileResponse:
+    """
+    Serve a capture. Other formats than the captured one, and variants
+    (size, rotation, inversion, bit depth and dithering) are transcoded from
+    the capture on first request and cached.
+    """
+    name = capture_name(view.name, profile)
     capture = None
 
-    if view.captures:
-        if timestamp and (
-            capture := next(
-                (c for c in view.captures if c.timestamp == timestamp), None
+    if fresh and not timestamp:
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(
+                    capture_scheduler.capture(
+                        config, view.config, CapturePriority.on_demand
+                    )
+                ),
+                timeout=config.server.capture_request_timeout,
+            )
+        except TimeoutError:
+            logger.warning(
+                f"Fresh capture of view '{view.name}' timed out, "
+                "serving last capture"
             )
-        ):
-            capture = capture
+
+    if timestamp:
+        capture = capture_index.find(name, timestamp)
+
+    if not capture:
+        capture = capture_index.latest(name)
+
+    if capture:
+        capture_file = config.server.capture_path / capture.filename
+
+        try:
+            file_stat = capture_file.stat()
+        except FileNotFoundError:
+            logger.warning(f"Capture file `{capture_file}` missing")
+            capture_index.remove(capture.filename)
         else:
-            capture = view.last_capture
+            transcode = (
+                capture.format != capture_format or not variant.is_default
+            )
+            headers = {
+                "Content-Disposition": "inline",
+                # Capture files are never rewritten, so the pixel hash and
+                # name identify their content without reading them
+                "ETag": (
+                    '"{}"'.format(variant_key(capture.hash, capture.filename))
+                    if capture.hash
+                    else await asyncio.to_thread(file_etag, capture_file)
+                ),
+                "Last-Modified": formatdate(file_stat.st_mtime, usegmt=True),
+                # Historic captures never change, the latest one may
+                "Cache-Control": (
+                    "public, max-age=31536000, immutable"
+                    if timestamp and capture.timestamp == timestamp
+                    else "no-cache"
+                ),
+            }
+
+            # The latest capture is kept when capturing fails, with the
+            # error of the last attempt
+            if not timestamp and (state := capture_index.state(name)):
+                if state.error and state.filename == capture.filename:
+                    headers["X-Capture-Error"] = (
+                        state.error.splitlines()[0]
+                        .encode("latin-1", "replace")
+                        .decode("latin-1")
+                    )
+
+            if transcode:
+                headers["ETag"] = '"{}"'.format(
+                    variant_key(
+                        capture.hash or headers["ETag"],
+                        capture_format.value,
+                        variant.model_dump_json(),
+                        capture_config.model_dump_json(),
+                    )
+                )
+
+            if is_not_modified(request.headers, headers):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers=headers,
+                )
+
+            if not transcode:
+                return FileResponse(
+                    capture_file,
+                    media_type=capture_format.media_type,
+                    headers=headers,
+                    stat_result=file_stat,
+                )
+
+            content, hit = await transcode_cache.get(
+                headers["ETag"],
+                lambda: asyncio.get_running_loop().run_in_executor(
+                    capture_scheduler.executor,
+                    render_variant,
+                    capture_file,
+                    capture_config,
+                    capture_format,
+                    variant,
+                ),
+            )
+            headers["X-Cache"] = "HIT" if hit else "MISS"
 
-        if capture and capture.format == capture_format:
-            return FileResponse(
-                config.server.capture_path / capture.filename,
-                media_type=f"image/{capture_format.value}",
-                headers={"Content-Disposition": "inline"},
+            return Response(
+                content, media_type=capture_format.media_type, headers=headers
             )
 
     raise HTTPException(
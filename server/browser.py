@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable
+
+from loguru import logger
+from playwright.async_api import (
+    async_playwright,
+    Browser,
+    BrowserContext,
+    Page,
+    Playwright,
+    Route,
+)
+
+
+class BrowserPool:
+    """
+    Long-lived Chromium instance shared by all captures.
+
+    Browser contexts are reused for identical context arguments (viewport,
+    scale, locale, timezone), and pages can be kept loaded between captures.
+    Requests of all pages are passed to `route_handler`, if given. The
+    browser is relaunched after `max_captures` captures, when the resident
+    memory of its processes exceeds `max_rss` megabytes, or when it has
+    crashed.
+    """
+
+    def __init__(
+        self,
+        max_captures: int = 100,
+        max_rss: int | None = None,
+        route_handler: Callable[[Route], Awaitable[None]] | None = None,
+    ):
+        self.max_captures = max_captures
+        self.max_rss = max_rss
+        self.route_handler = route_handler
+
+        self._playwright: Playwright | None = None
+        self._browser: Browser | None = None
+        self._contexts: dict[str, BrowserContext] = {}
+        self._idle_pages: dict[str, list[Page]] = {}
+        self._lock = asyncio.Lock()
+        self._captures = 0
+        self._active = 0
+        self._recycle = False
+
+    @property
+    def is_running(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    async def start(self) -> None:
+        async with self._lock:
+            try:
+                await self._ensure_browser()
+            except Exception:
+                logger.exception("Could not launch browser")
+
+    async def stop(self) -> None:
+        async with self._lock:
+            await self._close_browser()
+
+            if self._playwright:
+                await self._playwright.stop()
+                self._playwright = None
+
+    @asynccontextmanager
+    async def page(
+        self, reuse: bool = False, **context_args
+    ) -> AsyncIterator[Page]:
+        """
+        Page in a context for the given arguments. With `reuse`, the page is
+        kept open afterwards and handed out again by later calls, unless it
+        was closed by the caller.
+        """
+        async with self._lock:
+            await self._ensure_browser()
+            key = self._context_key(context_args)
+            context = await self._get_context(key, context_args)
+            idle_pages = self._idle_pages.setdefault(key, [])
+            page = idle_pages.pop() if reuse and idle_pages else None
+            self._active += 1
+
+        try:
+            if not page:
+                page = await context.new_page()
+            yield page
+        finally:
+            async with self._lock:
+                reusable = (
+                    reuse
+                    and page
+                    and not page.is_closed()
+                    and self._contexts.get(key) is context
+                )
+
+                if reusable:
+                    self._idle_pages[key].append(page)
+
+            if page and not reusable:
+                try:
+                    await page.close()
+                except Exception as e:
+                    logger.debug(f"Could not close page: {e}")
+
+            # Scanning processes is slow, done in a thread before locking
+            rss = await asyncio.to_thread(browser_rss) if self.max_rss else 0
+
+            async with self._lock:
+                self._active -= 1
+                self._captures += 1
+                await self._check_recycle(rss)
+
+    async def _ensure_browser(self) -> Browser:
+        if self._browser and not self._browser.is_connected():
+            logger.warning("Browser disconnected, relaunching")
+            await self._close_browser()
+
+        if self._recycle and self._active == 0:
+            await self._close_browser()
+
+        if not self._browser:
+            if not self._playwright:
+                self._playwright = await async_playwright().start()
+
+            logger.info("Launching browser")
+            self._browser = await self._playwright.chromium.launch()
+            self._browser.on(
+                "disconnected",
+                lambda _: logger.warning("Browser process disconnected"),
+            )
+
+        return self._browser
+
+    def _context_key(self, context_args: dict) -> str:
+        return json.dumps(context_args, sort_keys=True, default=str)
+
+    async def _get_context(
+        self, key: str, context_args: dict
+    ) -> BrowserContext:
+        if key not in self._contexts:
+            logger.debug(f"Creating browser context, args={context_args}")
+            context = await self._browser.new_context(**context_args)
+
+            if self.route_handler:
+                await context.route("**/*", self.route_handler)
+
+            self._contexts[key] = context
+
+        return self._contexts[key]
+
+    async def _check_recycle(self, rss: int = 0) -> None:
+        """
+        Recycle the browser, given its memory usage `rss` (MB). It is only
+        closed here, the next page launches it again.
+        """
+        if not self._recycle:
+            if self._captures >= self.max_captures:
+                logger.info(
+                    f"Recycling browser after {self._captures} captures"
+                )
+                self._recycle = True
+
+            elif self.max_rss and rss > self.max_rss:
+                logger.info(
+                    "Recycling browser, memory usage {} MB exceeds {} MB".format(
+                        rss, self.max_rss
+                    )
+                )
+                self._recycle = True
+
+        # Runs after the capture succeeded, so it must not fail it
+        if self._recycle and self._active == 0:
+            try:
+                await self._close_browser()
+            except Exception:
+                logger.exception("Could not close browser")
+
+    async def _close_browser(self) -> None:
+        browser, self._browser = self._browser, None
+        self._contexts = {}
+        self._idle_pages = {}
+        self._captures = 0
+        self._recycle = False
+
+        if browser:
+            logger.info("Closing browser")
+            try:
+                await browser.close()
+            except Exception as e:
+                logger.debug(f"Could not close browser: {e}")
+
+
+def browser_rss() -> int:
+    """
+    Resident memory (MB) of all Chromium processes spawned by this process.
+
+    Only supported on Linux (reads `/proc`), returns 0 elsewhere.
+    """
+    proc_path = Path("/proc")
+
+    if not proc_path.exists():
+        return 0
+
+    parents = {}
+    processes = {}
+
+    for pid_path in proc_path.iterdir():
+        if not pid_path.name.isdigit():
+            continue
+
+        try:
+            status = dict(
+                line.split(":", 1)
+                for line in (pid_path / "status").read_text().splitlines()
+                if ":" in line
+            )
+            cmdline = (pid_path / "cmdline").read_bytes()
+        except OSError:
+            continue
+
+        pid = int(pid_path.name)
+        parents[pid] = int(status.get("PPid", "0").strip())
+
+        if b"chrom" in cmdline or b"headless_shell" in cmdline:
+            processes[pid] = int(status.get("VmRSS", "0 kB").split()[0])
+
+    def is_descendant(pid: int) -> bool:
+        while pid := parents.get(pid):
+            if pid == os.getpid():
+                return True
+        return False
+
+    return (
+        sum(rss for pid, rss in processes.items() if is_descendant(pid)) // 1024
+    )
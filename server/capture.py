@@ -1,39 +1,243 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+from multiprocessing import get_context
 from pathlib import Path
 from textwrap import wrap
-from time import mktime
+from time import mktime, time
+from urllib.parse import urlsplit
 
+import numpy as np
 from fastapi import APIRouter
 from loguru import logger
-from PIL import Image, ImageFont, ImageDraw, ImageOps
-from playwright.async_api import (
-    async_playwright,
-    TimeoutError,
-)
+from PIL import Image, ImageDraw, ImageOps
+from playwright.async_api import Page, TimeoutError
 
-from .models.config import Config, CaptureConfig, CaptureFormat
-from .models.server import ServerConfig
+from .browser import BrowserPool
+from .exceptions import CaptureMemoryError
+from .framebuffer import (
+    decode_framebuffer,
+    dirty_rectangles,
+    encode_delta,
+    encode_framebuffer,
+    image_indices,
+)
+from .homeassistant import StateMirror
+from .index import CaptureIndex, capture_name
+from .models.capture import Capture, CaptureResult, CaptureState
+from .models.config import (
+    Config,
+    CaptureConfig,
+    CaptureDither,
+    CaptureFormat,
+    CaptureVariant,
+    CaptureWaitUntil,
+    ViewConfig,
+    ViewRenderer,
+)
+from .models.server import ServerConfig, CaptureExecutor
+from .renderer import (
+    fetch_states,
+    font,
+    render_view,
+    unsupported_components,
+)
+from .util import atomic_write, image_hash
 
 
 assets_path = Path(__file__).parent.resolve() / "assets"
 router = APIRouter()
 
 
+def create_executor(server_config: ServerConfig) -> Executor:
+    """
+    Executor used for image post-processing and encoding, keeping the event
+    loop responsive while captures are processed.
+    """
+    max_workers = server_config.capture_workers or min(
+        server_config.capture_concurrency, os.cpu_count() or 1
+    )
+
+    logger.info(
+        "Using {} {} worker(s) for image processing".format(
+            max_workers, server_config.capture_executor.value
+        )
+    )
+
+    if server_config.capture_executor is CaptureExecutor.thread:
+        return ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="capture"
+        )
+
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=get_context("spawn")
+    )
+
+
 async def capture_screenshot(
     config: Config,
     url: str,
+    view: ViewConfig,
+    browser_pool: BrowserPool,
+    executor: Executor,
+    capture_index: CaptureIndex,
+    state_mirror: StateMirror | None = None,
+) -> list[CaptureResult]:
+    """
+    Capture a view with the default capture config and each of its device
+    profiles. The page is loaded once per distinct viewport, and all
+    outputs sharing a viewport are rendered from the same screenshot.
+    Views using the native renderer are drawn without a browser when all
+    of their components are supported, with states from `state_mirror`.
+    """
+    states = await native_render_states(config, view, state_mirror)
+    outputs: dict[tuple, list[tuple[str | None, CaptureConfig]]] = {}
+
+    for profile in [None, *view.profiles]:
+        capture_config = config.profiles[profile] if profile else config.capture
+        outputs.setdefault(viewport_key(capture_config), []).append(
+            (profile, capture_config)
+        )
+
+    results = []
+
+    for group in outputs.values():
+        start_time = time()
+        screenshot, error_message = None, None
+
+        if states is not None:
+            screenshot = await take_native_screenshot(
+                config, group[0][1], view, states, executor
+            )
+
+        if screenshot is None:
+            screenshot, error_message = await take_screenshot(
+                config, group[0][1], url, view.name, browser_pool, executor
+            )
+
+        for profile, capture_config in group:
+            results.append(
+                await store_capture(
+                    capture_config=capture_config,
+                    server_config=config.server,
+                    view_name=view.name,
+                    profile=profile,
+                    screenshot=screenshot,
+                    error_message=error_message,
+                    executor=executor,
+                    capture_index=capture_index,
+                    start_time=start_time,
+                )
+            )
+
+    if any(result.changed for result in results):
+        await asyncio.to_thread(capture_cleanup, config.server, capture_index)
+
+    return results
+
+
+def viewport_key(capture_config: CaptureConfig) -> tuple:
+    return capture_config.width, capture_config.height, capture_config.scale
+
+
+async def native_render_states(
+    config: Config, view: ViewConfig, state_mirror: StateMirror | None
+) -> dict[str, dict] | None:
+    """
+    Entity states to draw a view with, or None when the view is rendered
+    by the browser.
+    """
+    if view.renderer is not ViewRenderer.native:
+        return None
+
+    if unsupported := unsupported_components(view.components):
+        logger.warning(
+            "View '{}' uses components not supported natively ({}), "
+            "rendering in browser".format(
+                view.name, ", ".join(sorted(map(str, unsupported)))
+            )
+        )
+        return None
+
+    if not state_mirror:
+        logger.warning(
+            f"Home Assistant is not available to draw view '{view.name}', "
+            "rendering in browser"
+        )
+        return None
+
+    try:
+        return await fetch_states(state_mirror)
+    except Exception as e:
+        logger.warning(
+            f"Could not fetch states for view '{view.name}': {e}, "
+            "rendering in browser"
+        )
+        return None
+
+
+async def take_native_screenshot(
+    config: Config,
+    capture_config: CaptureConfig,
+    view: ViewConfig,
+    states: dict[str, dict],
+    executor: Executor,
+) -> Image.Image | None:
+    """Draw a view natively, returning None if it could not be drawn."""
+    start_time = time()
+
+    try:
+        image = await asyncio.get_running_loop().run_in_executor(
+            executor,
+            render_view,
+            view,
+            capture_config,
+            states,
+            config.locale.default,
+            config.timezone,
+            config.container.show_footer,
+            config.version,
+        )
+    except Exception:
+        logger.exception(
+            f"Could not render view '{view.name}' natively, using browser"
+        )
+        return None
+
+    logger.info(
+        "Rendered view '{}' natively in {} ms.".format(
+            view.name, round((time() - start_time) * 1000)
+        )
+    )
+    return image
+
+
+async def take_screenshot(
+    config: Config,
+    capture_config: CaptureConfig,
+    url: str,
     view_name: str,
-) -> Path:
-    capture_path = config.server.capture_path
-    tmp_capture_file = capture_path / "capture_tmp.png"
+    browser_pool: BrowserPool,
+    executor: Executor,
+) -> tuple[bytes | Image.Image | None, str | None]:
+    """
+    Load a page and take a screenshot, returning it or an error message.
+    When reusing pages, an already loaded dashboard is switched to the view
+    by its router instead of being loaded again.
+    """
+    screenshot = None
     error_message = "Unknown error occured"
+    reuse = config.server.capture_reuse_page
 
-    args = {"device_scale_factor": config.capture.scale}
+    args = {"device_scale_factor": capture_config.scale}
 
-    if config.capture.width and config.capture.height:
+    if capture_config.width and capture_config.height:
         args["viewport"] = {
-            "width": config.capture.width,
-            "height": config.capture.height,
+            "width": capture_config.width,
+            "height": capture_config.height,
         }
 
     if config.timezone:
@@ -41,118 +245,753 @@ async def capture_screenshot(
 
     args["locale"] = "no-NO" if config.locale == "nb" else "en-GB"
 
-    async with async_playwright() as p:
-        try:
-            logger.info(f'Launching browser, url="{url}", args={args}')
-            browser = await p.chromium.launch()
-            context = await browser.new_context(**args)
+    try:
+        async with browser_pool.page(reuse=reuse, **args) as page:
+            try:
+                start_time = time()
+                wait_until = capture_config.wait_until
 
-        except Exception as e:
-            logger.exception("Could not launch browser")
-            error_message = str(e)
+                switched = reuse and await is_dashboard_page(page, url)
 
-        else:
-            try:
-                logger.debug(f"Navigating to {url}")
-                page = await context.new_page()
+                if switched:
+                    logger.debug(f"Switching loaded page to {url}")
 
-                await page.goto(
-                    url=str(url),
-                    wait_until=config.capture.wait_until,
-                    timeout=config.capture.timeout,
-                )
+                    await page.evaluate(
+                        "path => window.dashboardNavigate(path)",
+                        urlsplit(url).path,
+                    )
+
+                    if wait_until is CaptureWaitUntil.networkidle:
+                        await page.wait_for_load_state(
+                            "networkidle", timeout=capture_config.timeout
+                        )
+                else:
+                    logger.debug(f"Navigating to {url}")
+
+                    await page.goto(
+                        url=str(url),
+                        wait_until=(
+                            "load"
+                            if wait_until is CaptureWaitUntil.ready
+                            else wait_until
+                        ),
+                        timeout=capture_config.timeout,
+                    )
+
+                # Load events do not fire again when switching views of a
+                # loaded page, so the dashboard signal is waited for in any
+                # case to not capture the view while it renders
+                if wait_until is CaptureWaitUntil.ready or switched:
+                    await wait_for_render(
+                        page,
+                        view_name,
+                        capture_config.timeout
+                        - int((time() - start_time) * 1000),
+                    )
 
-                if config.capture.delay:
+                if capture_config.delay:
                     logger.info(
-                        f"Delaying screenshot by {config.capture.delay} ms."
+                        f"Delaying screenshot by {capture_config.delay} ms."
                     )
-                    await page.wait_for_timeout(config.capture.delay)
+                    await page.wait_for_timeout(capture_config.delay)
 
                 logger.info(
                     "Capturing screenshot (view={}, timeout={} ms.)".format(
                         view_name,
-                        config.capture.timeout,
+                        capture_config.timeout,
                     )
                 )
 
-                await page.screenshot(
-                    path=tmp_capture_file, timeout=config.capture.timeout
+                screenshot = await screenshot_page(
+                    page,
+                    capture_config,
+                    config.server.capture_memory_budget * 2**20,
+                    executor,
                 )
+                error_message = None
 
             except TimeoutError as e:
                 logger.error(f"Timeout while generating screenshot: {e}")
-                error_message = f"Timeout ({config.capture.timeout} ms.)"
+                error_message = f"Timeout ({capture_config.timeout} ms.)"
 
             except Exception as e:
                 logger.exception("Could not generate screenshot")
                 error_message = str(e)
 
-            finally:
-                logger.debug("Closing the page")
-                await page.close()
+            if error_message and reuse:
+                # Start over with a fresh page rather than reusing this one
+                try:
+                    await page.close()
+                except Exception as e:
+                    logger.debug(f"Could not close page: {e}")
+
+    except Exception as e:
+        logger.exception("Could not launch browser")
+        error_message = str(e)
+
+    return screenshot, error_message
+
+
+async def screenshot_page(
+    page: Page,
+    capture_config: CaptureConfig,
+    memory_budget: int,
+    executor: Executor,
+) -> bytes | Image.Image:
+    """
+    Screenshot the viewport. When decoding the screenshot would take more
+    than half of the memory budget, it is taken in horizontal strips that
+    are reduced to the viewport size one at a time.
+    """
+    width, height = capture_config.width, capture_config.height
+    row_size = round(width * capture_config.scale) * 4
+    strip_height = int(memory_budget // 2 // row_size / capture_config.scale)
+
+    if capture_config.scale == 1 or strip_height >= height:
+        return await page.screenshot(type="png", timeout=capture_config.timeout)
 
-    logger.debug(f"Capture file exists: {tmp_capture_file.exists()}")
-    captured_file_path = None
+    strip_height = max(strip_height, 1)
+    logger.debug(
+        "Taking screenshot in {} strip(s) of {} px".format(
+            -(-height // strip_height), strip_height
+        )
+    )
 
-    if tmp_capture_file.exists():
-        captured_file_path = save_image(
-            image=Image.open(tmp_capture_file),
-            server_config=config.server,
-            capture_config=config.capture,
-            name=view_name,
+    loop = asyncio.get_running_loop()
+    image = Image.new("RGB", (width, height), (255, 255, 255))
+    peak_memory = 0
+
+    for top in range(0, height, strip_height):
+        size = (width, min(strip_height, height - top))
+        strip = await page.screenshot(
+            type="png",
+            clip={"x": 0, "y": top, "width": size[0], "height": size[1]},
+            timeout=capture_config.timeout,
+        )
+        strip, strip_memory = await loop.run_in_executor(
+            executor, reduce_strip, strip, size, memory_budget
         )
+        image.paste(strip, (0, top))
+        peak_memory = max(peak_memory, strip_memory)
 
-    else:
-        captured_file_path = save_image(
-            image=generate_fallback_image(config.capture, error_message),
-            server_config=config.server,
-            capture_config=config.capture,
-            name=view_name,
+    # Picked up by `MemoryMeter` when the image is processed
+    image.info["peak_memory"] = peak_memory + image_memory(image)
+    return image
+
+
+def reduce_strip(
+    screenshot: bytes, size: tuple[int, int], memory_budget: int
+) -> tuple[Image.Image, int]:
+    """
+    Resize a screenshot strip to its size in CSS pixels (runs in the
+    capture executor). Returns the strip and the peak memory used.
+    """
+    meter = MemoryMeter(memory_budget)
+
+    with Image.open(BytesIO(screenshot)) as image:
+        meter.track(image)
+        strip = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        meter.track(image, strip)
+
+    return strip.convert("RGB"), meter.peak
+
+
+async def is_dashboard_page(page: Page, url: str) -> bool:
+    """Whether the page has the dashboard app loaded from the given origin."""
+    if urlsplit(page.url)[:2] != urlsplit(url)[:2]:
+        return False
+
+    return await page.evaluate("typeof window.dashboardNavigate === 'function'")
+
+
+async def wait_for_render(page: Page, view_name: str, timeout: int) -> None:
+    """
+    Wait for the dashboard to signal that all cards have loaded (or failed),
+    and log how long each card took. Capturing proceeds after `timeout` ms.
+    """
+    timeout = max(timeout, 1)
+
+    try:
+        await page.wait_for_function(
+            "window.dashboardReady === true", timeout=timeout
         )
+    except TimeoutError:
+        logger.warning(
+            f"View '{view_name}' not ready after {timeout} ms., capturing anyway"
+        )
+        return
+
+    timings = await page.evaluate("window.dashboardTimings")
+    cards = sorted(timings["cards"], key=lambda card: -card["duration"])
+
+    for card in cards:
+        if card["status"] == "error":
+            logger.warning(
+                "Card '{}' of view '{}' failed after {} ms.: {}".format(
+                    card["type"], view_name, card["duration"], card["error"]
+                )
+            )
+        else:
+            logger.debug(
+                "Card '{}' of view '{}' loaded in {} ms.".format(
+                    card["type"], view_name, card["duration"]
+                )
+            )
+
+    logger.info(
+        "View '{}' ready in {} ms. ({} card(s){})".format(
+            view_name,
+            timings["duration"],
+            len(cards),
+            (
+                f", slowest: '{cards[0]['type']}' in {cards[0]['duration']} ms."
+                if cards
+                else ""
+            ),
+        )
+    )
+
 
-    capture_cleanup(config.server)
-    return captured_file_path
+async def store_capture(
+    capture_config: CaptureConfig,
+    server_config: ServerConfig,
+    view_name: str,
+    profile: str | None,
+    screenshot: bytes | Image.Image | None,
+    error_message: str | None,
+    executor: Executor,
+    capture_index: CaptureIndex,
+    start_time: float,
+) -> CaptureResult:
+    """
+    Render a screenshot (or the fallback image) for one output of a view,
+    and save it unless identical to the last capture of that output. On
+    failure, the last successful capture is kept when configured to.
+    """
+    name = capture_name(view_name, profile)
+    loop = asyncio.get_running_loop()
+    memory_budget = server_config.capture_memory_budget * 2**20
+    capture_state = capture_index.state(name)
+    last_capture = capture_index.latest(name, capture_config.format)
+
+    if screenshot is not None:
+        try:
+            image_data, image_hash, peak_memory = await loop.run_in_executor(
+                executor,
+                render_screenshot,
+                screenshot,
+                capture_config,
+                memory_budget,
+            )
+        except CaptureMemoryError as e:
+            logger.error(f"Could not process capture of view '{name}': {e}")
+            screenshot, error_message = None, str(e)
+
+    if screenshot is None:
+        if (
+            server_config.capture_keep_on_error
+            and capture_state
+            and not capture_state.fallback
+            and last_capture
+            and capture_state.filename == last_capture.filename
+        ):
+            logger.info(f"Keeping last good capture of view '{name}'")
+            await asyncio.to_thread(
+                capture_index.update_state,
+                name,
+                capture_state.model_copy(
+                    update={"checked": int(time()), "error": error_message}
+                ),
+            )
+
+            return CaptureResult(
+                view_name=view_name,
+                profile=profile,
+                success=False,
+                changed=False,
+                filename=capture_state.filename,
+                hash=capture_state.hash,
+                error=error_message,
+                duration=round(time() - start_time, 3),
+            )
+
+        image_data, image_hash, peak_memory = await loop.run_in_executor(
+            executor, render_fallback_image, capture_config, error_message
+        )
+
+    logger.debug(
+        "Processed capture of view '{}' (peak memory {} MB)".format(
+            name, round(peak_memory / 2**20, 1)
+        )
+    )
+
+    changed = not (
+        capture_state
+        and last_capture
+        and capture_state.filename == last_capture.filename
+        and capture_state.hash == image_hash
+    )
+
+    if changed:
+        captured_file_path = await asyncio.to_thread(
+            save_image,
+            image_data=image_data,
+            server_config=server_config,
+            capture_config=capture_config,
+            name=name,
+            capture_index=capture_index,
+        )
+    else:
+        logger.info(f"View '{name}' unchanged, keeping last capture")
+        captured_file_path = server_config.capture_path / last_capture.filename
+
+    await asyncio.to_thread(
+        capture_index.update_state,
+        name,
+        CaptureState(
+            filename=captured_file_path.name,
+            hash=image_hash,
+            checked=int(time()),
+            error=error_message,
+            fallback=error_message is not None,
+        ),
+    )
+
+    return CaptureResult(
+        view_name=view_name,
+        profile=profile,
+        success=error_message is None,
+        changed=changed,
+        filename=captured_file_path.name,
+        hash=image_hash,
+        error=error_message,
+        duration=round(time() - start_time, 3),
+        peak_memory=peak_memory,
+    )
+
+
+def render_screenshot(
+    screenshot: bytes | Image.Image,
+    capture_config: CaptureConfig,
+    memory_budget: int | None = None,
+) -> tuple[bytes, str, int]:
+    """
+    Post-process and encode a screenshot, or a natively rendered image
+    (runs in the capture executor). Returns the encoded image, its pixel
+    hash and the peak memory used. Screenshots that would exceed the memory
+    budget once decoded raise `CaptureMemoryError` instead.
+    """
+    meter = MemoryMeter(memory_budget)
+
+    if isinstance(screenshot, Image.Image):
+        image = process_image(screenshot, capture_config, meter)
+    else:
+        with Image.open(BytesIO(screenshot)) as image:
+            image = process_image(image, capture_config, meter)
+
+    return encode_image(image, capture_config), image_hash(image), meter.peak
+
+
+def render_fallback_image(
+    capture_config: CaptureConfig, message: str = None
+) -> tuple[bytes, str, int]:
+    """
+    Generate and encode a fallback image (runs in the capture executor).
+    Returns the encoded image, its pixel hash and the peak memory used.
+    Images are memoized, as failures tend to repeat.
+    """
+    return _render_fallback_image(capture_config.model_dump_json(), message)
+
+
+@lru_cache(maxsize=16)
+def _render_fallback_image(
+    capture_config_json: str, message: str | None
+) -> tuple[bytes, str, int]:
+    capture_config = CaptureConfig.model_validate_json(capture_config_json)
+    meter = MemoryMeter()
+    image = generate_fallback_image(capture_config, message)
+    image = process_image(image, capture_config, meter)
+    return encode_image(image, capture_config), image_hash(image), meter.peak
+
+
+def render_delta(
+    capture_config: CaptureConfig,
+    target: Path,
+    timestamp: int,
+    base: Path | None = None,
+) -> bytes:
+    """
+    Encode the regions of `target` that changed since the `base` capture,
+    or the full frame when there is no usable base.
+    """
+    levels = capture_config.gray_levels
+
+    return _render_delta(
+        target,
+        target.stat().st_mtime_ns,
+        timestamp,
+        base,
+        base.stat().st_mtime_ns if base else None,
+        tuple(levels) if levels else None,
+        capture_config.rle,
+        capture_config.delta_max_area,
+    )
+
+
+@lru_cache(maxsize=16)
+def _render_delta(
+    target: Path,
+    target_mtime: int,
+    timestamp: int,
+    base: Path | None,
+    base_mtime: int | None,
+    levels: tuple[int, ...] | None,
+    rle: bool,
+    max_area: float,
+) -> bytes:
+    indices, bits = load_framebuffer(target, levels)
+    rectangles = None
+
+    if base == target:
+        rectangles = []
+    elif base:
+        base_indices, base_bits = load_framebuffer(base, levels)
+
+        if base_indices.shape == indices.shape and base_bits == bits:
+            rectangles = dirty_rectangles(base_indices, indices)
+            area = sum(width * height for _, _, width, height in rectangles)
+
+            if area > max_area * indices.size:
+                rectangles = None
+
+    return encode_delta(indices, bits, rectangles, timestamp, rle)
+
+
+def load_framebuffer(
+    path: Path, levels: tuple[int, ...] | None = None
+) -> tuple[np.ndarray, int]:
+    """Pixel values of a capture file as stored in a framebuffer."""
+    if path.suffix == f".{CaptureFormat.raw.value}":
+        return decode_framebuffer(path.read_bytes())
+
+    with Image.open(path) as image:
+        return image_indices(image, levels)
+
+
+def render_variant(
+    path: Path,
+    capture_config: CaptureConfig,
+    capture_format: CaptureFormat,
+    variant: CaptureVariant,
+) -> bytes:
+    """
+    Transcode a capture file to another format and/or variant (runs in the
+    capture executor).
+    """
+    image = load_capture_image(path, capture_config.gray_levels)
+
+    if image.mode in ("1", "P"):
+        image = image.convert("L")
+
+    width, height = variant.size(image.size)
+    update = {
+        "format": capture_format,
+        "width": width,
+        "height": height,
+        "rotate": variant.rotate,
+        "invert": variant.invert,
+    }
+
+    if variant.bit_depth:
+        update.update(bit_depth=variant.bit_depth, palette=None)
+    if variant.dither:
+        update.update(dither=variant.dither)
+
+    variant_config = capture_config.model_copy(update=update)
+    image = process_image(image, variant_config)
+    return encode_image(image, variant_config)
+
+
+def load_capture_image(path: Path, levels: list[int] | None = None) -> Image:
+    """Open a capture file, mapping framebuffer pixels to their gray levels."""
+    if path.suffix != f".{CaptureFormat.raw.value}":
+        with Image.open(path) as image:
+            image.load()
+            return image
+
+    indices, bits = decode_framebuffer(path.read_bytes())
+
+    if bits < 8:
+        if levels:
+            lut = np.zeros(256, dtype=np.uint8)
+            lut[: len(levels)] = levels
+        else:
+            lut = np.minimum(np.arange(256) * 255 // (2**bits - 1), 255)
+        indices = lut.astype(np.uint8)[indices]
+
+    return Image.fromarray(indices)
 
 
 def save_image(
-    image: Image,
+    image_data: bytes,
     server_config: ServerConfig,
     capture_config: CaptureConfig,
     name: str,
+    capture_index: CaptureIndex,
 ) -> Path:
-    output_format = capture_config.format
+    timestamp = int(mktime(datetime.now().timetuple()))
+
+    # Published captures never change (they are served as immutable), later
+    # captures within the same second take the next free timestamp
+    if (latest := capture_index.latest(name)) and latest.timestamp >= timestamp:
+        timestamp = latest.timestamp + 1
+
     output_file = server_config.capture_path / "{}_{}.{}".format(
-        int(mktime(datetime.now().timetuple())),
+        timestamp,
+        name,
+        capture_config.format.value.lower(),
+    )
+
+    atomic_write(output_file, image_data)
+    capture_index.add(
         name,
-        output_format.value.lower(),
+        Capture(
+            timestamp=timestamp,
+            filename=output_file.name,
+            format=capture_config.format,
+        ),
     )
 
+    return output_file
+
+
+class MemoryMeter:
+    """
+    Peak memory of the decoded images held at once while processing a
+    capture. Images exceeding the budget raise `CaptureMemoryError` before
+    being decoded.
+    """
+
+    def __init__(self, budget: int | None = None):
+        self.budget = budget
+        self.peak = 0
+
+    def track(self, *images: Image.Image) -> None:
+        size = sum(image_memory(image) for image in images)
+
+        if self.budget and size > self.budget:
+            raise CaptureMemoryError(
+                "Capture exceeds memory budget ({} of {} MB)".format(
+                    round(size / 2**20), round(self.budget / 2**20)
+                )
+            )
+
+        self.peak = max(
+            self.peak,
+            size,
+            *(image.info.get("peak_memory", 0) for image in images),
+        )
+
+
+def image_memory(image: Image.Image) -> int:
+    """Decoded size of an image, multiband pixels are stored in 4 bytes."""
+    return image.width * image.height * (1 if len(image.getbands()) == 1 else 4)
+
+
+def process_image(
+    image: Image,
+    capture_config: CaptureConfig,
+    meter: MemoryMeter | None = None,
+) -> Image:
+    """
+    Post-process a capture. Images are converted to grayscale first and
+    reduced by whole factors before resampling, keeping the copies made
+    along the way small.
+    """
+    meter = meter or MemoryMeter()
+    meter.track(image)
+
+    def step(processed: Image) -> Image:
+        meter.track(image, processed)
+        return processed
+
+    # Grayscale
+    if capture_config.grayscale and image.mode != "L":
+        image = step(image.convert("L"))
+
     # Invert
     if capture_config.invert:
         if image.mode in ("L", "P"):
-            image = ImageOps.invert(image)
+            image = step(ImageOps.invert(image))
         else:
-            image = image.convert("RGB")
-            image = ImageOps.invert(image)
-
-    # Grayscale
-    if capture_config.grayscale and image.mode != "L":
-        image = image.convert("L")
+            image = step(image.convert("RGB"))
+            image = step(ImageOps.invert(image))
 
     # Resize (if needed)
     if capture_config.width and capture_config.height:
         if image.size != (capture_config.width, capture_config.height):
-            image = image.resize(
-                (capture_config.width, capture_config.height), Image.LANCZOS
+            image = step(
+                image.resize(
+                    (capture_config.width, capture_config.height),
+                    Image.LANCZOS,
+                    reducing_gap=3.0,
+                )
             )
 
+    # Rotate (clockwise)
+    if capture_config.rotate:
+        image = step(image.rotate(-capture_config.rotate, expand=True))
+
+    # Quantize (and dither) to the gray levels of the display
+    if levels := capture_config.gray_levels:
+        image = step(quantize_image(image, levels, capture_config.dither))
+
+    return image
+
+
+def quantize_image(
+    image: Image, levels: list[int], dither: CaptureDither
+) -> Image:
+    """
+    Reduce an image to the given gray levels, returning a palette image
+    (or a bilevel image when the levels are black and white only).
+    """
+    levels = np.array(sorted(levels), dtype=np.float32)
+    palette = [int(level) for level in levels for _ in range(3)]
+
+    if dither is CaptureDither.floyd_steinberg:
+        # Pillow implements Floyd-Steinberg natively, given an RGB image
+        palette_image = Image.new("P", (1, 1))
+        palette_image.putpalette(palette)
+        quantized = image.convert("RGB").quantize(
+            palette=palette_image, dither=Image.Dither.FLOYDSTEINBERG
+        )
+        indices = np.asarray(quantized)
+    else:
+        pixels = np.asarray(image.convert("L"), dtype=np.float32)
+        lut = np.abs(np.arange(256)[:, None] - levels[None, :]).argmin(1)
+        lut = lut.astype(np.uint8)
+
+        if dither is CaptureDither.atkinson:
+            indices = _error_diffusion(pixels, levels, lut, ATKINSON_KERNEL)
+        else:
+            if dither is CaptureDither.ordered:
+                step = 255 / (len(levels) - 1)
+                pixels = pixels + (_bayer_threshold(pixels.shape) - 0.5) * step
+            indices = lut[np.clip(pixels + 0.5, 0, 255).astype(np.uint8)]
+
+    if levels.tolist() == [0, 255]:
+        return Image.fromarray(indices.astype(bool))
+
+    quantized = Image.frombytes(
+        "P", image.size, np.ascontiguousarray(indices, dtype=np.uint8)
+    )
+    quantized.putpalette(palette)
+    return quantized
+
+
+# (row offset, column offset, weight) of the error distributed to neighbours
+ATKINSON_KERNEL = [
+    (0, 1, 1 / 8),
+    (0, 2, 1 / 8),
+    (1, -1, 1 / 8),
+    (1, 0, 1 / 8),
+    (1, 1, 1 / 8),
+    (2, 0, 1 / 8),
+]
+
+
+def _bayer_threshold(shape: tuple[int, int], size: int = 8) -> np.ndarray:
+    """Tiled Bayer threshold map with values in (0, 1)."""
+    matrix = np.zeros((1, 1))
+
+    while matrix.shape[0] < size:
+        matrix = np.block(
+            [[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]]
+        )
+
+    matrix = (matrix + 0.5) / matrix.size
+    reps = (shape[0] // size + 1, shape[1] // size + 1)
+    return np.tile(matrix, reps)[: shape[0], : shape[1]].astype(np.float32)
+
+
+def _error_diffusion(
+    pixels: np.ndarray,
+    levels: np.ndarray,
+    lut: np.ndarray,
+    kernel: list[tuple[int, int, float]],
+) -> np.ndarray:
+    """
+    Error diffusion dithering, vectorized over anti-diagonal wavefronts.
+
+    With kernels reaching at most one column back on later rows, all pixels
+    with the same `t = x + 2y` are independent and are processed together.
+    Pixels are stored skewed, at row `t` and column `y`, so that wavefronts
+    and the neighbours they diffuse to are contiguous slices of rows.
+    """
+    height, width = pixels.shape
+    wavefronts = width + 2 * (height - 1)
+    # (wavefront offset, row offset, weight) of each neighbour
+    targets = [(dx + 2 * dy, dy, weight) for dy, dx, weight in kernel]
+    weights = {weight for _, _, weight in targets}
+
+    rows, columns = np.indices((height, width), sparse=True)
+    # Column 0 is padding for kernels reaching back one column
+    skewed_index = (columns + 2 * rows, rows + 1)
+    buffer = np.zeros(
+        (
+            wavefronts + max(dt for dt, _, _ in targets),
+            height + 1 + max(dy for _, dy, _ in targets),
+        ),
+        dtype=np.float32,
+    )
+    buffer[skewed_index] = pixels
+    indices = np.zeros(buffer.shape, dtype=np.uint8)
+    level_values = levels.astype(np.float32)
+
+    # Diffused errors keep values within half a gray range of 0-255, the
+    # padded lookup table saves clipping them
+    padding = 256
+    padded_lut = np.concatenate(
+        [np.full(padding, lut[0]), lut, np.full(padding, lut[-1])]
+    ).astype(np.uint8)
+
+    for t in range(wavefronts):
+        first = max(0, (t - width + 2) // 2) + 1
+        last = min(height - 1, t // 2) + 2
+
+        values = buffer[t, first:last]
+        quantized = padded_lut[(values + (padding + 0.5)).astype(np.intp)]
+        indices[t, first:last] = quantized
+        error = values - level_values[quantized]
+        weighted = {weight: error * weight for weight in weights}
+
+        for dt, dy, weight in targets:
+            buffer[t + dt, first + dy : last + dy] += weighted[weight]
+
+    return indices[skewed_index]
+
+
+def encode_image(image: Image, capture_config: CaptureConfig) -> bytes:
+    output_format = capture_config.format
+
+    if output_format is CaptureFormat.raw:
+        return encode_framebuffer(
+            image, capture_config.gray_levels, capture_config.rle
+        )
+
+    buffer = BytesIO()
+
     try:
-        image.save(output_file, output_format.value.upper())
+        # Palette PNGs are written with the smallest bit depth fitting the
+        # palette, `optimize` additionally minimizes zlib output
+        image.save(buffer, output_format.value.upper(), optimize=True)
     except Exception as e:
-        logger.error(f"Failed to save image: {e}")
-        image.save(output_file)
+        logger.error(f"Failed to encode image: {e}")
+        buffer = BytesIO()
+        image.convert("RGB").save(buffer, output_format.value.upper())
 
-    return output_file
+    return buffer.getvalue()
 
 
 def generate_fallback_image(
@@ -167,17 +1006,10 @@ def generate_fallback_image(
         )
     )
 
-    fallback_path = assets_path / "static" / "error.png"
-    font_path = assets_path / "jetbrains-mono.ttf"
-
     try:
-        fallback_img = Image.open(fallback_path)
-        target_size = fallback_img.size
+        target_size = (capture_config.width, capture_config.height)
+        fallback_img = fallback_base_image(target_size)
 
-        if capture_config.width and capture_config.height:
-            target_size = (capture_config.width, capture_config.height)
-
-        fallback_img.thumbnail(target_size, Image.LANCZOS)
         new_img = Image.new("RGB", target_size, (255, 255, 255))
         new_img.paste(
             fallback_img,
@@ -188,12 +1020,11 @@ def generate_fallback_image(
         )
 
         if message:
-            font = ImageFont.truetype(str(font_path), 20)
             draw = ImageDraw.Draw(new_img)
             draw.text(
                 (15, 15),
                 "\n".join(wrap(message, 50)),
-                font=font,
+                font=font(20),
                 stroke_width=2,
                 stroke_fill=(255, 255, 255),
                 fill=(0, 0, 0),
@@ -204,36 +1035,48 @@ def generate_fallback_image(
     return new_img
 
 
-def capture_cleanup(server_config: ServerConfig) -> None:
+@lru_cache(maxsize=8)
+def fallback_base_image(size: tuple[int, int]) -> Image:
+    """Error image scaled to fit `size`, loaded once per size."""
+    with Image.open(assets_path / "static" / "error.png") as image:
+        image.thumbnail(size, Image.LANCZOS)
+        return image.copy()
+
+
+def capture_cleanup(
+    server_config: ServerConfig, capture_index: CaptureIndex
+) -> None:
+    """
+    Delete all but the `capture_keep_count` newest captures of each name and
+    format. The capture a name's state refers to is always kept, as it is
+    served until the view changes.
+    """
     logger.info("Cleaning up capture files")
 
     capture_path = server_config.capture_path
     capture_keep_count = server_config.capture_keep_count
-    tmp_capture_file = capture_path / "capture_tmp.png"
-
-    if not capture_path.exists():
-        return
 
-    if tmp_capture_file.exists():
-        logger.debug(f"Deleting temporary capture file `{tmp_capture_file}`")
-        tmp_capture_file.unlink()
+    for name in capture_index.names():
+        state = capture_index.state(name)
 
-    for capture_format in CaptureFormat:
-        capture_files = sorted(
-            [f for f in capture_path.glob(f"*.{capture_format.value}")]
-        )
+        for capture_format in CaptureFormat:
+            captures = capture_index.captures(name, capture_format)
+            deleted = [
+                capture
+                for capture in captures[capture_keep_count:]
+                if not state or capture.filename != state.filename
+            ]
 
-        if len(capture_files) <= capture_keep_count:
-            continue
+            if not deleted:
+                continue
 
-        logger.info(
-            "Deleting {}/{} capture files of type {}".format(
-                len(capture_files) - capture_keep_count,
-                len(capture_files),
-                capture_format.value,
+            logger.info(
+                "Deleting {}/{} capture files of type {} for {}".format(
+                    len(deleted), len(captures), capture_format.value, name
+                )
             )
-        )
 
-        for file in capture_files[:-capture_keep_count]:
-            logger.debug(f"Deleting capture file `{file}`")
-            file.unlink()
+            for capture in deleted:
+                logger.debug(f"Deleting capture file `{capture.filename}`")
+                (capture_path / capture.filename).unlink(missing_ok=True)
+                capture_index.remove(capture.filename)
@@ -1,15 +1,18 @@
 from functools import lru_cache
 
 from fastapi import Depends, HTTPException, status
-from homeassistant_api import Client as HomeAssistantClient
 from loguru import logger
 from yaml import load as yaml_load, scanner
 
 from .configuration import yaml_loader
 from .exceptions import ConfigurationError
-from .models.capture import Capture
-from .models.config import Config, CaptureFormat
+from .history import HistoryCache
+from .homeassistant import HomeAssistant, StateMirror
+from .index import CaptureIndex
+from .models.config import CaptureConfig, Config
 from .models.server import ServerConfig
+from .scheduler import CaptureScheduler
+from .transcode import TranscodeCache
 from .models.view import View
 
 
@@ -48,45 +51,59 @@ def get_config() -> Config:
         return Config(server=server_config)
 
 
-async def get_homeassistant_client(
-    config: Config = Depends(get_config),
-) -> HomeAssistantClient:
-    ha_url = str(config.homeassistant.url)
-    if ha_url.endswith("/"):
-        ha_url = ha_url[:-1]
-    yield HomeAssistantClient(
-        f"{ha_url}/api",
-        config.homeassistant.token.get_secret_value(),
+@lru_cache()
+def get_capture_index() -> CaptureIndex:
+    capture_index = CaptureIndex(ServerConfig().capture_path)
+    capture_index.scan()
+    return capture_index
+
+
+@lru_cache()
+def get_capture_scheduler() -> CaptureScheduler:
+    return CaptureScheduler(ServerConfig(), get_capture_index())
+
+
+@lru_cache()
+def get_transcode_cache() -> TranscodeCache:
+    return TranscodeCache(ServerConfig().capture_variant_cache_size * 2**20)
+
+
+@lru_cache()
+def get_history_cache() -> HistoryCache:
+    return HistoryCache(ServerConfig().homeassistant_history_cache_size * 2**20)
+
+
+@lru_cache()
+def get_homeassistant_client() -> HomeAssistant:
+    server_config = ServerConfig()
+    return HomeAssistant(
+        get_config().homeassistant,
+        timeout=server_config.homeassistant_timeout,
+        max_concurrency=server_config.homeassistant_concurrency,
     )
 
 
+@lru_cache()
+def get_state_mirror() -> StateMirror:
+    return StateMirror(get_homeassistant_client())
+
+
 def get_view(
     view_name: str,
     config: Config = Depends(get_config),
+    capture_index: CaptureIndex = Depends(get_capture_index),
 ) -> View:
     views = {v.name: v for v in config.views}
 
     if view_config := views.get(view_name):
-        captures = []
-        capture_path = config.server.capture_path
-
-        for fmt in CaptureFormat:
-            captures.extend(
-                Capture(
-                    timestamp=int(capture_file.name.split("_")[0]),
-                    filename=capture_file.name,
-                    format=fmt,
-                )
-                for capture_file in capture_path.glob(
-                    f"*_{view_name}.{fmt.value}"
-                )
-                if "_tmp" not in capture_file.name
-            )
+        capture_state = capture_index.state(view_name)
 
         return View(
             name=view_config.name,
-            captures=sorted(captures, key=lambda c: c.timestamp, reverse=True),
+            captures=capture_index.captures(view_name),
             config=view_config,
+            last_checked=capture_state.checked if capture_state else None,
+            last_error=capture_state.error if capture_state else None,
         )
 
     raise HTTPException(
@@ -97,5 +114,27 @@ def get_view(
 
 def get_views(
     config: Config = Depends(get_config),
+    capture_index: CaptureIndex = Depends(get_capture_index),
 ):
-    return [get_view(view_config.name, config) for view_config in config.views]
+    return [
+        get_view(view_config.name, config, capture_index)
+        for view_config in config.views
+    ]
+
+
+def get_capture_config(
+    profile: str = None,
+    view: View = Depends(get_view),
+    config: Config = Depends(get_config),
+) -> CaptureConfig:
+    """Capture config of a view, or of one of its device profiles."""
+    if not profile:
+        return config.capture
+
+    if profile in view.config.profiles:
+        return config.profiles[profile]
+
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f"Profile '{profile}' not found for view '{view.name}'",
+    )
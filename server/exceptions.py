@@ -1,2 +1,6 @@
 class ConfigurationError(Exception):
     pass
+
+
+class CaptureMemoryError(Exception):
+    pass
@@ -0,0 +1,269 @@
+import struct
+
+import numpy as np
+from PIL import Image
+
+
+# Header: magic, width, height, bits per pixel, flags (little-endian)
+HEADER = struct.Struct("<4sHHBB")
+MAGIC = b"HAFB"
+FLAG_RLE = 0x01
+
+# Delta header: magic, timestamp, width, height, bits per pixel, flags and
+# number of regions, each region header is followed by its pixel data
+DELTA_HEADER = struct.Struct("<4sIHHBBH")
+DELTA_REGION = struct.Struct("<HHHHI")
+DELTA_MAGIC = b"HADL"
+FLAG_FULL = 0x02
+
+
+def encode_framebuffer(
+    image: Image, levels: list[int] | None = None, rle: bool = False
+) -> bytes:
+    """
+    Encode an image as a packed grayscale framebuffer.
+
+    Each pixel is stored as its index into `levels` (0 being the darkest),
+    or its gray value when not quantized, using 1, 2, 4 or 8 bits per pixel
+    packed most significant bits first. Rows are padded to whole bytes.
+    With `rle`, the pixel data is compressed using PackBits.
+    """
+    indices, bits = image_indices(image, levels)
+    data = pack_pixels(indices, bits)
+
+    if rle:
+        data = packbits(data)
+
+    width, height = image.size
+    header = HEADER.pack(MAGIC, width, height, bits, FLAG_RLE if rle else 0)
+    return header + data
+
+
+def decode_framebuffer(data: bytes) -> tuple[np.ndarray, int]:
+    """Decode a packed framebuffer into pixel values and bits per pixel."""
+    if not (header := decode_framebuffer_header(data)):
+        raise ValueError("Invalid framebuffer header")
+
+    pixels = data[HEADER.size :]
+
+    if header["rle"]:
+        pixels = unpackbits(pixels)
+
+    indices = unpack_pixels(
+        pixels, header["width"], header["height"], header["bits"]
+    )
+    return indices, header["bits"]
+
+
+def decode_framebuffer_header(data: bytes) -> dict | None:
+    """Parse a framebuffer header, returning None if not a framebuffer."""
+    if len(data) < HEADER.size:
+        return None
+
+    magic, width, height, bits, flags = HEADER.unpack_from(data)
+
+    if magic != MAGIC:
+        return None
+
+    return {
+        "width": width,
+        "height": height,
+        "bits": bits,
+        "rle": bool(flags & FLAG_RLE),
+    }
+
+
+def image_indices(
+    image: Image, levels: list[int] | None = None
+) -> tuple[np.ndarray, int]:
+    """Pixel values of an image as stored in a framebuffer, and their bits."""
+    if image.mode == "1":
+        indices = np.asarray(image, dtype=np.uint8)
+    elif image.mode == "P" and levels:
+        indices = np.asarray(image)
+    else:
+        indices = np.asarray(image.convert("L"))
+
+    bits = 8
+    if levels:
+        bits = next(b for b in (1, 2, 4, 8) if len(levels) <= 2**b)
+
+    return indices, bits
+
+
+def pack_pixels(indices: np.ndarray, bits: int) -> bytes:
+    """Pack 8-bit pixel values into rows of `bits` bits per pixel."""
+    if bits == 8:
+        return indices.astype(np.uint8).tobytes()
+
+    per_byte = 8 // bits
+    height, width = indices.shape
+    padded_width = -(-width // per_byte) * per_byte
+
+    padded = np.zeros((height, padded_width), dtype=np.uint8)
+    padded[:, :width] = indices & ((1 << bits) - 1)
+
+    packed = np.zeros((height, padded_width // per_byte), dtype=np.uint8)
+    for i in range(per_byte):
+        packed |= padded[:, i::per_byte] << (8 - bits * (i + 1))
+
+    return packed.tobytes()
+
+
+def unpack_pixels(
+    data: bytes, width: int, height: int, bits: int
+) -> np.ndarray:
+    """Unpack rows of `bits` bits per pixel into 8-bit pixel values."""
+    row_size = -(-width * bits // 8)
+    packed = np.frombuffer(data, dtype=np.uint8, count=row_size * height)
+    packed = packed.reshape(height, row_size)
+
+    if bits == 8:
+        return packed
+
+    per_byte = 8 // bits
+    indices = np.empty((height, row_size * per_byte), dtype=np.uint8)
+    for i in range(per_byte):
+        indices[:, i::per_byte] = (packed >> (8 - bits * (i + 1))) & (
+            (1 << bits) - 1
+        )
+
+    return indices[:, :width]
+
+
+def packbits(data: bytes) -> bytes:
+    """
+    PackBits run-length encoding. A header byte `n` is followed by `n + 1`
+    literal bytes when below 128, or by one byte repeated `257 - n` times
+    when above 128.
+    """
+    if not data:
+        return b""
+
+    values = np.frombuffer(data, dtype=np.uint8)
+    starts = np.flatnonzero(np.diff(values)) + 1
+    starts = np.concatenate(([0], starts)).tolist()
+    ends = starts[1:] + [len(data)]
+
+    output = bytearray()
+    literal_start = 0
+
+    def flush_literal(end: int) -> None:
+        for chunk in range(literal_start, end, 128):
+            size = min(128, end - chunk)
+            output.append(size - 1)
+            output.extend(data[chunk : chunk + size])
+
+    for start, end in zip(starts, ends):
+        # Runs shorter than 3 bytes are cheaper to store as literals
+        if end - start < 3:
+            continue
+
+        flush_literal(start)
+        literal_start = end
+
+        for chunk in range(start, end, 128):
+            size = min(128, end - chunk)
+            if size == 1:
+                output += bytes((0, data[start]))
+            else:
+                output += bytes((257 - size, data[start]))
+
+    flush_literal(len(data))
+    return bytes(output)
+
+
+def unpackbits(data: bytes) -> bytes:
+    """Decode PackBits run-length encoded data."""
+    output = bytearray()
+    position = 0
+
+    while position < len(data):
+        header = data[position]
+        position += 1
+
+        if header < 128:
+            output += data[position : position + header + 1]
+            position += header + 1
+        elif header > 128:
+            output += data[position : position + 1] * (257 - header)
+            position += 1
+
+    return bytes(output)
+
+
+def dirty_rectangles(
+    base: np.ndarray, target: np.ndarray, tile: int = 8
+) -> list[tuple[int, int, int, int]]:
+    """
+    Regions `(x, y, width, height)` covering all pixels that differ.
+
+    Changed pixels are grouped into tiles, and tiles into bands of
+    consecutive changed tile rows. Each band is split into one rectangle
+    per run of changed tile columns, with horizontal edges aligned to
+    `tile` pixels so that regions start on whole bytes.
+    """
+    height, width = target.shape
+    rows, columns = -(-height // tile), -(-width // tile)
+
+    changed = np.zeros((rows * tile, columns * tile), dtype=bool)
+    changed[:height, :width] = base != target
+    tiles = changed.reshape(rows, tile, columns, tile).any(axis=(1, 3))
+
+    rectangles = []
+
+    for y0, y1 in _runs(tiles.any(axis=1)):
+        for x0, x1 in _runs(tiles[y0:y1].any(axis=0)):
+            x, y = x0 * tile, y0 * tile
+            rectangles.append(
+                (x, y, min(x1 * tile, width) - x, min(y1 * tile, height) - y)
+            )
+
+    return rectangles
+
+
+def encode_delta(
+    indices: np.ndarray,
+    bits: int,
+    rectangles: list[tuple[int, int, int, int]] | None,
+    timestamp: int,
+    rle: bool = False,
+) -> bytes:
+    """
+    Encode the given regions of a framebuffer, each packed like a
+    framebuffer of its own. Without `rectangles` the full frame is encoded.
+    """
+    height, width = indices.shape
+    flags = FLAG_RLE if rle else 0
+
+    if rectangles is None:
+        rectangles = [(0, 0, width, height)]
+        flags |= FLAG_FULL
+
+    output = [
+        DELTA_HEADER.pack(
+            DELTA_MAGIC, timestamp, width, height, bits, flags, len(rectangles)
+        )
+    ]
+
+    for x, y, region_width, region_height in rectangles:
+        data = pack_pixels(
+            indices[y : y + region_height, x : x + region_width], bits
+        )
+
+        if rle:
+            data = packbits(data)
+
+        output.append(
+            DELTA_REGION.pack(x, y, region_width, region_height, len(data))
+        )
+        output.append(data)
+
+    return b"".join(output)
+
+
+def _runs(mask: np.ndarray) -> list[tuple[int, int]]:
+    """Start and end (exclusive) of each run of true values."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    return list(zip(starts.tolist(), ends.tolist()))
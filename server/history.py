@@ -0,0 +1,210 @@
+import asyncio
+import json
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from time import time
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from .models.cache import CacheStats
+
+
+class HistoryEntry:
+    """
+    States of one entity from `start` up to `end`, oldest first, and the
+    windows recently requested from it.
+    """
+
+    def __init__(self, start: datetime, end: datetime, states: list[dict]):
+        self.start = start
+        self.end = end
+        self.size = 0
+        self.states: list[tuple[float, dict, int]] = []
+        # Start of the last request of each window length, and its time
+        self.windows: dict[int, tuple[datetime, float]] = {}
+        self.extend(states, end)
+
+    def request(
+        self, start: datetime, end: datetime, retention: float
+    ) -> datetime:
+        """
+        Record a requested window, returning the oldest start of the windows
+        requested within the last `retention` seconds.
+        """
+        now = time()
+        self.windows[round((end - start).total_seconds())] = (start, now)
+        self.windows = {
+            length: (window_start, requested)
+            for length, (window_start, requested) in self.windows.items()
+            if requested >= now - retention
+        }
+        return min(window_start for window_start, _ in self.windows.values())
+
+    def extend(self, states: list[dict], end: datetime) -> None:
+        """Append states fetched since `end` of the entry."""
+        for state in states:
+            timestamp = _timestamp(state)
+
+            if self.states:
+                last_timestamp, last_state, _ = self.states[-1]
+
+                # A fetched window starts with the state in effect at its
+                # start, which is the last known state
+                if timestamp <= last_timestamp or _same_state(
+                    state, last_state
+                ):
+                    continue
+
+            size = len(json.dumps(state))
+            self.states.append((timestamp, state, size))
+            self.size += size
+
+        self.end = end
+
+    def trim(self, start: datetime) -> None:
+        """Drop states before `start`, except the one in effect at `start`."""
+        index = self._index(start)
+
+        if index > 1:
+            self.size -= sum(size for _, _, size in self.states[: index - 1])
+            del self.states[: index - 1]
+
+        self.start = max(self.start, start)
+
+    def window(self, start: datetime, end: datetime) -> list[dict]:
+        """States from `start` to `end`, as returned by Home Assistant."""
+        # Starting with the state in effect at `start`
+        first = max(0, self._index(start) - 1)
+        states = [
+            state for _, state, _ in self.states[first : self._index(end)]
+        ]
+
+        if states and _timestamp(states[0]) < start.timestamp():
+            start_time = start.astimezone(timezone.utc).isoformat()
+            states[0] = {
+                **states[0],
+                "last_changed": start_time,
+                "last_updated": start_time,
+            }
+
+        return states
+
+    def _index(self, moment: datetime) -> int:
+        """Index of the first state after `moment`."""
+        return bisect_right(
+            self.states, moment.timestamp(), key=lambda state: state[0]
+        )
+
+
+class HistoryCache:
+    """
+    Size-bounded LRU cache of entity histories.
+
+    Each entry holds the states of one entity covering the windows requested
+    within the last `window_retention` seconds, so cards showing different
+    periods of an entity share it. Requests for windows starting within an
+    entry only fetch the states since its last fetch from Home Assistant,
+    and states before all recent windows are dropped.
+    """
+
+    def __init__(self, max_size: int, window_retention: float = 3600):
+        self.max_size = max_size
+        self.window_retention = window_retention
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[tuple, HistoryEntry] = OrderedDict()
+        self._size = 0
+        self._pending: dict[tuple, asyncio.Task] = {}
+
+    async def get(
+        self,
+        entity_id: str,
+        start: datetime,
+        end: datetime,
+        fetch: Callable[[datetime, datetime], Awaitable[list[dict]]],
+        significant_changes_only: bool = False,
+    ) -> list[dict]:
+        """
+        States of an entity from `start` to `end` (aware datetimes), using
+        `fetch` to get the states of a period from Home Assistant.
+        """
+        key = (entity_id, significant_changes_only)
+
+        # Requests for the same entity are served one after another, so
+        # that only the first one fetches what is missing
+        while task := self._pending.get(key):
+            await asyncio.wait([task])
+
+        task = asyncio.ensure_future(self._get(key, start, end, fetch))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            entries=len(self._entries),
+            size=self._size,
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+    async def _get(
+        self,
+        key: tuple,
+        start: datetime,
+        end: datetime,
+        fetch: Callable[[datetime, datetime], Awaitable[list[dict]]],
+    ) -> list[dict]:
+        entry = self._entries.get(key)
+
+        hit = entry and entry.start <= start <= entry.end
+
+        if hit:
+            states = await fetch(entry.end, end) if end > entry.end else []
+            self.hits += 1
+        else:
+            states = await fetch(start, end)
+            self.misses += 1
+
+        # The entry may have been evicted while fetching
+        if cached := self._entries.pop(key, None):
+            self._size -= cached.size
+
+        if hit:
+            entry.extend(states, max(end, entry.end))
+        else:
+            windows = entry.windows if entry else {}
+            entry = HistoryEntry(start, end, states)
+            entry.windows = windows
+
+        entry.trim(entry.request(start, end, self.window_retention))
+        self._store(key, entry)
+
+        return entry.window(start, end)
+
+    def _store(self, key: tuple, entry: HistoryEntry) -> None:
+        if entry.size > self.max_size:
+            return
+
+        self._entries[key] = entry
+        self._size += entry.size
+
+        while self._size > self.max_size:
+            (evicted_key, _), evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+            logger.debug(f"Evicted history of {evicted_key} from history cache")
+
+
+def _timestamp(state: dict) -> float:
+    return datetime.fromisoformat(state["last_updated"]).timestamp()
+
+
+def _same_state(state: dict, other: dict) -> bool:
+    return state.get("state") == other.get("state") and state.get(
+        "attributes"
+    ) == other.get("attributes")
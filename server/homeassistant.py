@@ -0,0 +1,169 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from time import time
+from typing import AsyncIterator, Callable
+
+import aiohttp
+from homeassistant_api import Client as HomeAssistantClient
+from loguru import logger
+
+from .models.config import HomeAssistantConfig
+from .models.homeassistant import StateMirrorStatus
+from .socket import HomeAssistantSocket
+
+
+class HomeAssistant:
+    """
+    Async Home Assistant REST client shared by all requests.
+
+    Requests reuse keep-alive connections of one pool, are cancelled after
+    `timeout` seconds, and at most `max_concurrency` run at once (others
+    wait for a free slot, which counts towards their timeout). Websocket
+    commands are sent through one long-lived `socket`.
+    """
+
+    def __init__(
+        self,
+        config: HomeAssistantConfig,
+        timeout: float,
+        max_concurrency: int,
+    ):
+        self.api_url = f"{str(config.url).rstrip('/')}/api"
+        self.token = config.token.get_secret_value()
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.socket = HomeAssistantSocket(f"{self.api_url}/", self.token)
+
+        self._client: HomeAssistantClient | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[HomeAssistantClient]:
+        """
+        Client for one request (or a few related ones), to be used with its
+        `async_` methods.
+        """
+        async with asyncio.timeout(self.timeout), self._semaphore:
+            yield self._get_client()
+
+    async def stop(self) -> None:
+        await self.socket.stop()
+
+        if self._session:
+            await self._session.close()
+            self._session = self._client = None
+
+    def _get_client(self) -> HomeAssistantClient:
+        if not self._client:
+            logger.debug(f"Connecting to Home Assistant at {self.api_url}")
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency, keepalive_timeout=60
+                ),
+            )
+            self._client = HomeAssistantClient(
+                self.api_url,
+                self.token,
+                use_async=True,
+                async_cache_session=self._session,
+            )
+
+        return self._client
+
+
+class StateMirror:
+    """
+    In-memory copy of all Home Assistant entity states.
+
+    States are loaded with `get_states` on every websocket (re)connection,
+    after subscribing to `state_changed` events which keep them current.
+    The mirror is only `healthy` while the connection it was loaded on is
+    up; callers should use the REST API otherwise. Events are also passed
+    to callbacks registered with `on_change`.
+    """
+
+    def __init__(self, ha: HomeAssistant):
+        self.ha = ha
+        self.states: dict[str, dict] = {}
+
+        self._change_callbacks: list[Callable[[dict], None]] = []
+
+        self._synced: float | None = None
+        self._synced_connection: int | None = None
+        self._last_event: float | None = None
+
+    def start(self) -> None:
+        self.ha.socket.on_connect(self._sync)
+
+        if self.ha.socket.connected:
+            asyncio.create_task(self._sync())
+        else:
+            self.ha.socket.start()
+
+    def on_change(self, callback: Callable[[dict], None]) -> None:
+        self._change_callbacks.append(callback)
+
+    @property
+    def healthy(self) -> bool:
+        return (
+            self.ha.socket.connected
+            and self._synced_connection == self.ha.socket.connection_count
+        )
+
+    def get(self, entity_id: str) -> dict | None:
+        """State of an entity, `None` if unknown or the mirror is unhealthy."""
+        if self.healthy:
+            return self.states.get(entity_id)
+
+    def status(self) -> StateMirrorStatus:
+        return StateMirrorStatus(
+            healthy=self.healthy,
+            entities=len(self.states),
+            synced=_datetime(self._synced),
+            last_event=_datetime(self._last_event),
+        )
+
+    async def _sync(self) -> None:
+        connection = self.ha.socket.connection_count
+
+        try:
+            async with asyncio.timeout(self.ha.timeout):
+                # Subscribe first to not miss changes while loading, events
+                # older than the loaded states arrive before them
+                await self.ha.socket.call(
+                    {"type": "subscribe_events", "event_type": "state_changed"},
+                    on_event=self._on_event,
+                )
+                states = await self.ha.socket.call({"type": "get_states"})
+        except Exception as e:
+            logger.warning(f"Could not load Home Assistant states: {e}")
+            # Reconnecting retries with backoff
+            await self.ha.socket.reconnect()
+            return
+
+        self.states = {state["entity_id"]: state for state in states}
+        self._synced = time()
+        self._synced_connection = connection
+        logger.info(f"Loaded {len(self.states)} Home Assistant states")
+
+    def _on_event(self, event: dict) -> None:
+        data = event.get("data", {})
+        self._last_event = time()
+
+        if new_state := data.get("new_state"):
+            self.states[data["entity_id"]] = new_state
+        else:
+            self.states.pop(data.get("entity_id"), None)
+
+        for callback in self._change_callbacks:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception("State change callback failed")
+
+
+def _datetime(timestamp: float | None) -> datetime | None:
+    if timestamp is not None:
+        return datetime.fromtimestamp(timestamp, timezone.utc)
@@ -0,0 +1,218 @@
+from bisect import bisect_left, insort
+from pathlib import Path
+from threading import Lock
+
+from loguru import logger
+
+from .models.capture import Capture, CaptureFormat, CaptureState
+from .util import atomic_write
+
+# Seconds between writes of a capture state only differing in check time
+STATE_WRITE_INTERVAL = 15 * 60
+
+
+class CaptureIndex:
+    """
+    In-memory index of capture files, keyed by view, format and timestamp.
+
+    The index is built once from the capture directory and kept up to date
+    by the capture pipeline, so requests never have to scan the filesystem.
+    """
+
+    def __init__(self, capture_path: Path):
+        self.capture_path = capture_path
+
+        self._lock = Lock()
+        self._captures: dict[str, dict[CaptureFormat, list[Capture]]] = {}
+        self._filenames: dict[str, tuple[str, Capture]] = {}
+        self._states: dict[str, CaptureState] = {}
+        self._written: dict[str, CaptureState] = {}
+
+    def scan(self) -> None:
+        with self._lock:
+            self._captures = {}
+            self._filenames = {}
+            self._states = {}
+            self._written = {}
+
+            if not self.capture_path.exists():
+                return
+
+            paths = list(self.capture_path.iterdir())
+
+            for path in paths:
+                if path.suffix == ".json" and (state := self._read_state(path)):
+                    self._states[path.stem] = state
+                    self._written[path.stem] = state
+
+            for path in paths:
+                if parsed := parse_capture_filename(path.name):
+                    self._add(*parsed)
+
+        logger.info(
+            "Indexed {} capture(s) for {} view(s) in `{}`".format(
+                len(self._filenames), len(self._captures), self.capture_path
+            )
+        )
+
+    def add(self, view_name: str, capture: Capture) -> None:
+        with self._lock:
+            self._add(view_name, capture)
+
+    def remove(self, filename: str) -> None:
+        with self._lock:
+            if not (entry := self._filenames.pop(filename, None)):
+                return
+
+            view_name, capture = entry
+            captures = self._captures[view_name][capture.format]
+            position = self._position(captures, capture.timestamp)
+
+            if position < len(captures):
+                captures.pop(position)
+
+    def get(self, filename: str) -> Capture | None:
+        if entry := self._filenames.get(filename):
+            return entry[1]
+        return None
+
+    def names(self) -> list[str]:
+        """Names of views (and profiles) with captures."""
+        with self._lock:
+            return list(self._captures)
+
+    def captures(
+        self,
+        view_name: str | None = None,
+        capture_format: CaptureFormat | None = None,
+    ) -> list[Capture]:
+        """All captures (newest first), optionally filtered."""
+        with self._lock:
+            captures = [
+                capture
+                for name, formats in self._captures.items()
+                if view_name is None or name == view_name
+                for fmt, fmt_captures in formats.items()
+                if capture_format is None or fmt == capture_format
+                for capture in fmt_captures
+            ]
+
+        return sorted(captures, key=lambda c: c.timestamp, reverse=True)
+
+    def latest(
+        self, view_name: str, capture_format: CaptureFormat | None = None
+    ) -> Capture | None:
+        with self._lock:
+            candidates = [
+                captures[-1]
+                for fmt, captures in self._captures.get(view_name, {}).items()
+                if captures
+                and (capture_format is None or fmt == capture_format)
+            ]
+
+        return max(candidates, key=lambda c: c.timestamp, default=None)
+
+    def find(
+        self,
+        view_name: str,
+        timestamp: int,
+        capture_format: CaptureFormat | None = None,
+    ) -> Capture | None:
+        with self._lock:
+            for fmt, captures in self._captures.get(view_name, {}).items():
+                if capture_format is not None and fmt != capture_format:
+                    continue
+
+                position = self._position(captures, timestamp)
+
+                if position < len(captures):
+                    return captures[position]
+
+        return None
+
+    def state(self, view_name: str) -> CaptureState | None:
+        return self._states.get(view_name)
+
+    def update_state(self, view_name: str, state: CaptureState) -> None:
+        """
+        Update the state of a view. States only differing from the written
+        one in check time are kept in memory for `STATE_WRITE_INTERVAL`,
+        sparing the storage a write on every unchanged check.
+        """
+        written = self._written.get(view_name)
+
+        if not (
+            written
+            and written.model_copy(update={"checked": state.checked}) == state
+            and state.checked - written.checked < STATE_WRITE_INTERVAL
+        ):
+            atomic_write(
+                self.capture_path / f"{view_name}.json",
+                state.model_dump_json().encode(),
+            )
+            self._written[view_name] = state
+
+        with self._lock:
+            self._states[view_name] = state
+
+            if entry := self._filenames.get(state.filename):
+                entry[1].hash = state.hash
+
+    def _add(self, view_name: str, capture: Capture) -> None:
+        if capture.filename in self._filenames:
+            return
+
+        if state := self._states.get(view_name):
+            if state.filename == capture.filename:
+                capture.hash = state.hash
+
+        captures = self._captures.setdefault(view_name, {})
+        insort(
+            captures.setdefault(capture.format, []),
+            capture,
+            key=lambda c: c.timestamp,
+        )
+        self._filenames[capture.filename] = (view_name, capture)
+
+    def _position(self, captures: list[Capture], timestamp: int) -> int:
+        position = bisect_left(captures, timestamp, key=lambda c: c.timestamp)
+
+        if (
+            position < len(captures)
+            and captures[position].timestamp == timestamp
+        ):
+            return position
+
+        return len(captures)
+
+    def _read_state(self, path: Path) -> CaptureState | None:
+        try:
+            return CaptureState.model_validate_json(path.read_bytes())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring invalid capture state `{path}`: {e}")
+            return None
+
+
+def capture_name(view_name: str, profile: str | None = None) -> str:
+    """Name captures of a view are indexed by, per device profile."""
+    return f"{view_name}@{profile}" if profile else view_name
+
+
+def parse_capture_filename(filename: str) -> tuple[str, Capture] | None:
+    """Parse `{timestamp}_{view_name}.{format}` into view name and capture."""
+    stem, _, extension = filename.rpartition(".")
+    timestamp, _, view_name = stem.partition("_")
+
+    if not timestamp.isdigit() or not view_name:
+        return None
+
+    try:
+        capture_format = CaptureFormat(extension)
+    except ValueError:
+        return None
+
+    return view_name, Capture(
+        timestamp=int(timestamp),
+        filename=filename,
+        format=capture_format,
+    )
@@ -0,0 +1,208 @@
+import asyncio
+import mimetypes
+from collections import OrderedDict
+from fnmatch import fnmatch
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from loguru import logger
+from playwright.async_api import Route
+
+from .models.cache import CacheStats
+
+
+class RequestInterceptor:
+    """
+    Answers requests of capture pages without loopback HTTP.
+
+    Files in `static_path` are listed once (as the built frontend does not
+    change while running) and served from a memory cache of up to
+    `max_size` bytes, other requests to the server are dispatched to the
+    ASGI app in-process. Requests matching one of the `block_urls` glob
+    patterns are aborted, and other external requests are passed through.
+    """
+
+    def __init__(
+        self,
+        app,
+        origin: str,
+        static_path: Path,
+        block_urls: list[str] = [],
+        max_size: int = 64 * 2**20,
+    ):
+        self.app = app
+        self.origin = urlsplit(origin)[:2]
+        self.static_path = static_path.resolve()
+        self.block_urls = block_urls
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.dispatched = 0
+        self.blocked = 0
+
+        self._static_files: set[str] | None = None
+        self._files: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self._size = 0
+
+    async def handle(self, route: Route) -> None:
+        request = route.request
+        url = urlsplit(request.url)
+
+        if any(fnmatch(request.url, pattern) for pattern in self.block_urls):
+            logger.debug(f"Blocking request to {request.url}")
+            self.blocked += 1
+            await route.abort("blockedbyclient")
+            return
+
+        if url[:2] != self.origin:
+            await route.continue_()
+            return
+
+        path = unquote(url.path)
+        # Dashboard routes serve the app, as the SPA handler does
+        static_file = (
+            "/index.html"
+            if request.resource_type == "document" and not Path(path).suffix
+            else path
+        )
+
+        if request.method == "GET" and (
+            file := await self._static_file(static_file)
+        ):
+            body, content_type = file
+            await route.fulfill(
+                status=200, body=body, headers={"content-type": content_type}
+            )
+            return
+
+        self.dispatched += 1
+
+        try:
+            status, headers, body = await asgi_request(
+                self.app,
+                method=request.method,
+                path=path,
+                raw_path=url.path,
+                query=url.query,
+                headers=await request.all_headers(),
+                body=request.post_data_buffer or b"",
+            )
+        except Exception:
+            logger.exception(f"Could not serve request to {request.url}")
+            status, headers, body = 500, {}, b""
+
+        await route.fulfill(status=status, headers=headers, body=body)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            entries=len(self._files),
+            size=self._size,
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+    async def _static_file(self, path: str) -> tuple[bytes, str] | None:
+        if self._static_files is None:
+            self._static_files = await asyncio.to_thread(
+                _list_files, self.static_path
+            )
+
+        if path not in self._static_files:
+            return None
+
+        if file := self._files.get(path):
+            self._files.move_to_end(path)
+            self.hits += 1
+            return file
+
+        self.misses += 1
+        file_path = self.static_path / path.lstrip("/")
+        content_type, _ = mimetypes.guess_type(file_path.name)
+        file = (
+            await asyncio.to_thread(file_path.read_bytes),
+            content_type or "application/octet-stream",
+        )
+
+        if len(file[0]) <= self.max_size:
+            self._files[path] = file
+            self._size += len(file[0])
+
+            while self._size > self.max_size:
+                _, (body, _) = self._files.popitem(last=False)
+                self._size -= len(body)
+
+        return file
+
+
+def _list_files(path: Path) -> set[str]:
+    """Paths (from `/`) of all files below a directory."""
+    if not path.is_dir():
+        return set()
+
+    return {
+        f"/{file_path.relative_to(path).as_posix()}"
+        for file_path in path.rglob("*")
+        if file_path.is_file()
+    }
+
+
+async def asgi_request(
+    app,
+    method: str,
+    path: str,
+    raw_path: str | None = None,
+    query: str = "",
+    headers: dict[str, str] = {},
+    body: bytes = b"",
+) -> tuple[int, dict[str, str], bytes]:
+    """Dispatch an HTTP request to an ASGI app in-process."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": (raw_path or path).encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers.items()
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 0),
+    }
+    request_sent = False
+    response = {"status": 500, "headers": {}, "body": bytearray()}
+    disconnected = asyncio.Event()
+
+    async def receive() -> dict:
+        nonlocal request_sent
+
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {
+                name.decode("latin-1"): value.decode("latin-1")
+                for name, value in message.get("headers", [])
+                if name.lower() != b"content-length"
+            }
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+
+    return response["status"], response["headers"], bytes(response["body"])
@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+
+
+class CacheStats(BaseModel):
+    entries: int
+    size: int
+    max_size: int | None = None
+    hits: int
+    misses: int
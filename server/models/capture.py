@@ -7,12 +7,20 @@ from pydantic import BaseModel, computed_field
 class CaptureFormat(str, Enum):
     png = "png"
     bmp = "bmp"
+    raw = "raw"
+
+    @property
+    def media_type(self) -> str:
+        if self is CaptureFormat.raw:
+            return "application/octet-stream"
+        return f"image/{self.value}"
 
 
 class Capture(BaseModel):
     timestamp: int
     filename: str
     format: CaptureFormat
+    hash: str | None = None
 
     @computed_field
     @property
@@ -28,4 +36,26 @@ class CaptureDetails(Capture):
     bit_depth: int = None
     has_transparency: bool | None = None
     palette_size: int | None = None
-    compression: int | None = None
+    compression: int | str | None = None
+
+
+class CaptureResult(BaseModel):
+    view_name: str
+    profile: str | None = None
+    success: bool
+    changed: bool = True
+    filename: str | None = None
+    hash: str | None = None
+    error: str | None = None
+    duration: float | None = None
+    # Peak memory (bytes) of the images held while processing the capture
+    peak_memory: int | None = None
+
+
+class CaptureState(BaseModel):
+    filename: str
+    hash: str
+    checked: int
+    # Error of the last check, and whether `filename` is a fallback image
+    error: str | None = None
+    fallback: bool = False
@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 from os import environ
 from typing import Annotated
 
@@ -7,6 +7,7 @@ from pydantic import (
     BaseModel,
     SecretStr,
     Field,
+    model_validator,
 )
 
 from .server import ServerConfig
@@ -28,10 +29,19 @@ class ContainerConfig(BaseModel):
     show_footer: bool = True
 
 
+class ViewRenderer(str, Enum):
+    browser = "browser"
+    # Drawn with Pillow, for views using supported components only
+    native = "native"
+
+
 class ViewConfig(BaseModel):
     name: str = "dashboard"
     style: str | None = None
     components: list[dict] = [dict(type="sun")]
+    # Device profiles the view is additionally captured with
+    profiles: list[str] = []
+    renderer: ViewRenderer = ViewRenderer.browser
 
 
 class CaptureWaitUntil(str, Enum):
@@ -39,6 +49,22 @@ class CaptureWaitUntil(str, Enum):
     domcontentloaded = "domcontentloaded"
     networkidle = "networkidle"
     commit = "commit"
+    # Signalled by the dashboard once all cards have loaded
+    ready = "ready"
+
+
+class CaptureDither(str, Enum):
+    none = "none"
+    floyd_steinberg = "floyd-steinberg"
+    atkinson = "atkinson"
+    ordered = "ordered"
+
+
+class CaptureRotation(IntEnum):
+    none = 0
+    clockwise = 90
+    upside_down = 180
+    counterclockwise = 270
 
 
 class CaptureConfig(BaseModel):
@@ -49,11 +75,69 @@ class CaptureConfig(BaseModel):
 
     invert: bool = False
     grayscale: bool = True
+    # Clockwise rotation in degrees, applied after resizing
+    rotate: CaptureRotation = CaptureRotation.none
+
+    # Quantization to `bit_depth` evenly spaced gray levels, or the gray
+    # levels (0-255) listed in `palette`
+    bit_depth: Annotated[int, Field(ge=1, le=8)] | None = None
+    palette: (
+        Annotated[
+            list[Annotated[int, Field(ge=0, le=255)]],
+            Field(min_length=2, max_length=256),
+        ]
+        | None
+    ) = None
+    dither: CaptureDither = CaptureDither.none
+
+    # Run-length encode `raw` framebuffer captures and deltas
+    rle: bool = False
+    # Deltas changing more than this share of the frame are sent in full
+    delta_max_area: Annotated[float, Field(ge=0, le=1)] = 0.5
 
     delay: Annotated[int, Field(ge=1000, le=30000)] | None = None
     timeout: Annotated[int, Field(ge=1000, le=30000)] = 5000
     wait_until: CaptureWaitUntil = CaptureWaitUntil.networkidle
 
+    @property
+    def gray_levels(self) -> list[int] | None:
+        if self.palette and len(set(self.palette)) > 1:
+            return sorted(set(self.palette))
+        if self.bit_depth and self.bit_depth < 8:
+            count = 2**self.bit_depth
+            return [round(i * 255 / (count - 1)) for i in range(count)]
+        return None
+
+
+class CaptureVariant(BaseModel):
+    """
+    Transformations applied to a capture when serving it. With only one of
+    `width` and `height`, the other is scaled to keep the aspect ratio.
+    """
+
+    width: Annotated[int, Field(ge=100, le=3000)] | None = None
+    height: Annotated[int, Field(ge=100, le=3000)] | None = None
+    rotate: CaptureRotation = CaptureRotation.none
+    invert: bool = False
+    bit_depth: Annotated[int, Field(ge=1, le=8)] | None = None
+    dither: CaptureDither | None = None
+
+    @property
+    def is_default(self) -> bool:
+        return self == CaptureVariant()
+
+    def size(self, size: tuple[int, int]) -> tuple[int, int]:
+        width, height = size
+
+        if self.width and self.height:
+            return self.width, self.height
+        if self.width:
+            return self.width, round(height * self.width / width)
+        if self.height:
+            return round(width * self.height / height), self.height
+
+        return size
+
 
 class Config(BaseModel):
     server: ServerConfig
@@ -63,4 +147,40 @@ class Config(BaseModel):
     container: ContainerConfig = ContainerConfig()
     views: list[ViewConfig] = [ViewConfig()]
     capture: CaptureConfig = CaptureConfig()
+    # Named capture configs for other devices, defaults to `capture` values
+    profiles: dict[
+        Annotated[str, Field(pattern=r"^[\w-]+$")], CaptureConfig
+    ] = {}
     version: str = environ.get("APP_VERSION")
+
+    @model_validator(mode="before")
+    @classmethod
+    def inherit_capture_config(cls, data):
+        if not isinstance(data, dict) or not data.get("profiles"):
+            return data
+
+        capture = data.get("capture") or {}
+        if isinstance(capture, BaseModel):
+            capture = capture.model_dump(exclude_unset=True)
+
+        return {
+            **data,
+            "profiles": {
+                name: (
+                    {**capture, **(profile or {})}
+                    if isinstance(profile, dict) or profile is None
+                    else profile
+                )
+                for name, profile in data["profiles"].items()
+            },
+        }
+
+    @model_validator(mode="after")
+    def check_view_profiles(self):
+        for view in self.views:
+            for profile in view.profiles:
+                if profile not in self.profiles:
+                    raise ValueError(
+                        f"Profile '{profile}' of view '{view.name}' not found"
+                    )
+        return self
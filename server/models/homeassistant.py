@@ -1,7 +1,8 @@
 from datetime import datetime
+from typing import Annotated
 
 from dateutil import parser
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 
 
 class Config(BaseModel):
@@ -25,6 +26,31 @@ class Entity(BaseModel):
     history_end: datetime | None = None
 
 
+class EntitiesRequest(BaseModel):
+    entity_ids: Annotated[list[str], Field(min_length=1, max_length=100)]
+    history: bool = False
+    period_start: datetime | None = None
+    period_end: datetime | None = None
+    significant_changes_only: bool = False
+
+
+class EntityError(BaseModel):
+    status_code: int
+    detail: str
+
+
+class Entities(BaseModel):
+    entities: dict[str, Entity] = {}
+    errors: dict[str, EntityError] = {}
+
+
+class StateMirrorStatus(BaseModel):
+    healthy: bool
+    entities: int
+    synced: datetime | None = None
+    last_event: datetime | None = None
+
+
 class CalendarEvent(BaseModel):
     entity_id: str
     calendar_name: str
@@ -20,6 +20,16 @@ class ServerLogLevel(str, Enum):
     debug = "debug"
 
 
+class CaptureExecutor(str, Enum):
+    process = "process"
+    thread = "thread"
+
+
+class CaptureTrigger(str, Enum):
+    interval = "interval"
+    events = "events"
+
+
 class ServerConfig(BaseSettings):
     model_config = ConfigDict(env_file=".env", extra="ignore")
 
@@ -32,6 +42,25 @@ class ServerConfig(BaseSettings):
     capture_interval: Annotated[int, Field(ge=60)] = 60 * 3
     capture_keep_count: Annotated[int, Field(ge=1)] = 15
     capture_wait_first: bool = False
+    capture_concurrency: Annotated[int, Field(ge=1, le=16)] = 2
+    capture_executor: CaptureExecutor = CaptureExecutor.process
+    capture_workers: Annotated[int, Field(ge=1)] | None = None
+    capture_request_timeout: Annotated[int, Field(ge=1)] = 30
+    capture_trigger: CaptureTrigger = CaptureTrigger.interval
+    capture_debounce: Annotated[float, Field(ge=0)] = 5
+    capture_min_interval: Annotated[float, Field(ge=0)] = 30
+    capture_browser_max_captures: Annotated[int, Field(ge=1)] = 100
+    capture_browser_max_rss: Annotated[int, Field(ge=64)] | None = None
+    capture_reuse_page: bool = False
+    capture_intercept_requests: bool = True
+    capture_block_urls: list[str] = []
+    capture_variant_cache_size: Annotated[int, Field(ge=0)] = 32
+    capture_memory_budget: Annotated[int, Field(ge=16)] = 256
+    capture_keep_on_error: bool = True
+    homeassistant_timeout: Annotated[float, Field(gt=0)] = 10
+    homeassistant_concurrency: Annotated[int, Field(ge=1)] = 8
+    homeassistant_mirror: bool = True
+    homeassistant_history_cache_size: Annotated[int, Field(ge=0)] = 16
     log_level: ServerLogLevel = ServerLogLevel.info
     log_filename: Path = "dashboard.log"
     log_json: bool = False
@@ -9,8 +9,10 @@ class View(BaseModel):
     name: str
     captures: list[Capture] = Field(default_factory=list)
     config: ViewConfig
+    last_checked: int | None = None
+    last_error: str | None = None
 
     @computed_field
     @property
     def last_capture(self) -> Capture | None:
-        return max(self.captures, key=lambda c: c.timestamp)
+        return max(self.captures, key=lambda c: c.timestamp, default=None)
@@ -0,0 +1,678 @@
+from bisect import bisect_left
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from textwrap import dedent
+from zoneinfo import ZoneInfo
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .homeassistant import StateMirror
+from .models.config import CaptureConfig, ViewConfig
+
+
+font_path = Path(__file__).parent.resolve() / "assets" / "jetbrains-mono.ttf"
+
+# Card types and group layouts the native renderer can draw
+NATIVE_CARDS = {"sun", "tile", "entities", "markdown"}
+NATIVE_GROUPS = {"vertical-stack", "horizontal-stack"}
+
+# Gray levels of the dashboard theme (`frontend/src/assets/main.css`),
+# views are drawn as grayscale images
+DARK = 0
+LIGHT = 55
+LIGHTER = 100
+LIGHTEST = 185
+WHITE = 255
+
+# Font size and line height (px) of Tailwind text sizes
+TEXT_XS = (12, 16)
+TEXT_SM = (14, 20)
+TEXT_BASE = (16, 24)
+TEXT_LG = (18, 28)
+
+PADDING = 16
+GAP = 16
+FOOTER_HEIGHT = 32
+# Cards are clipped to the viewport anyway
+CARD_MAX_HEIGHT = 1500
+
+MESSAGES = {
+    "en": {
+        "ago": "ago",
+        "no_data": "No data",
+        "sun": "Sun",
+        "sunrise": "Sunrise",
+        "sunset": "Sunset",
+        "dawn": "Dawn",
+        "dusk": "Dusk",
+        "solar_noon": "Solar noon",
+        "minute": ("minute", "minutes"),
+        "hour": ("hour", "hours"),
+        "day": ("day", "days"),
+    },
+    "nb": {
+        "ago": "siden",
+        "no_data": "Mangler data",
+        "sun": "Sol",
+        "sunrise": "Soloppgang",
+        "sunset": "Solnedgang",
+        "dawn": "Gryning",
+        "dusk": "Skumring",
+        "solar_noon": "Middag",
+        "minute": ("minutt", "minutter"),
+        "hour": ("time", "timer"),
+        "day": ("dag", "dager"),
+    },
+}
+
+
+def unsupported_components(components: list[dict]) -> set[str]:
+    """Types of the components the native renderer cannot draw."""
+    unsupported = set()
+
+    for component in components:
+        # Components with children are groups, as in the frontend
+        if "components" in component:
+            if component.get("type", "vertical-stack") not in NATIVE_GROUPS:
+                unsupported.add(component.get("type"))
+            unsupported |= unsupported_components(component["components"])
+        elif component.get("type") not in NATIVE_CARDS or (
+            component["type"] == "entities"
+            and component.get("display", "list") not in ("list", "grid")
+        ):
+            unsupported.add(component.get("type"))
+
+    return unsupported
+
+
+async def fetch_states(state_mirror: StateMirror) -> dict[str, dict]:
+    """
+    Current state of all Home Assistant entities, by entity id. States are
+    copied from the mirror when in sync, and fetched otherwise.
+    """
+    if state_mirror.healthy:
+        return dict(state_mirror.states)
+
+    async with state_mirror.ha.session() as client:
+        states = await client.async_request("states")
+
+    return {state["entity_id"]: state for state in states}
+
+
+class RenderContext:
+    """Entity states and settings shared by all cards of a view."""
+
+    def __init__(
+        self,
+        states: dict[str, dict],
+        locale: str | None = None,
+        timezone: str | None = None,
+    ):
+        self.states = states
+        self.messages = MESSAGES.get(locale or "en", MESSAGES["en"])
+        self.timezone = ZoneInfo(timezone) if timezone else None
+        self.now = datetime.now(self.timezone)
+
+    def t(self, key: str) -> str:
+        return self.messages[key]
+
+    def local_time(self, value: str) -> datetime:
+        return datetime.fromisoformat(value).astimezone(self.timezone)
+
+
+def render_view(
+    view: ViewConfig,
+    capture_config: CaptureConfig,
+    states: dict[str, dict],
+    locale: str | None = None,
+    timezone: str | None = None,
+    show_footer: bool = True,
+    version: str | None = None,
+) -> Image:
+    """
+    Draw a view the way the dashboard lays it out (runs in the capture
+    executor). Components are stacked vertically within the padding, and
+    content overflowing the viewport is clipped.
+    """
+    context = RenderContext(states, locale, timezone)
+    width, height = capture_config.width, capture_config.height
+    content_height = height - (FOOTER_HEIGHT if show_footer else 0)
+
+    image = Image.new("L", (width, height), WHITE)
+    component_image = render_stack(
+        view.components,
+        context,
+        width - 2 * PADDING,
+        vertical=True,
+        gap=style_gap(view.style),
+    )
+    image.paste(
+        component_image.crop(
+            (
+                0,
+                0,
+                component_image.width,
+                min(component_image.height, content_height - PADDING),
+            )
+        ),
+        (PADDING, PADDING),
+    )
+
+    if show_footer:
+        draw = ImageDraw.Draw(image)
+        y = height - FOOTER_HEIGHT // 2
+        draw_text(
+            draw,
+            (PADDING, y),
+            context.now.strftime("%d.%m.%y - %H:%M"),
+            TEXT_SM,
+            DARK,
+            anchor="lm",
+        )
+        draw_text(
+            draw,
+            (width - PADDING - 8, y),
+            f"{view.name} @ {version or 'dev'}",
+            TEXT_XS,
+            LIGHTEST,
+            anchor="rm",
+        )
+
+    return image
+
+
+def render_component(
+    component: dict, context: RenderContext, width: int
+) -> Image:
+    if "components" in component:
+        return render_stack(
+            component["components"],
+            context,
+            width,
+            vertical=component.get("type") != "horizontal-stack",
+            gap=style_gap(component.get("style")),
+        )
+
+    render_card = CARD_RENDERERS[component["type"]]
+    return render_card(component, context, width)
+
+
+def render_stack(
+    components: list[dict],
+    context: RenderContext,
+    width: int,
+    vertical: bool,
+    gap: int,
+) -> Image:
+    """Components stacked vertically, or side by side in equal columns."""
+    if not components:
+        return Image.new("L", (width, 0), WHITE)
+
+    if vertical:
+        images = [
+            render_component(component, context, width)
+            for component in components
+        ]
+        height = sum(image.height for image in images)
+        height += gap * (len(images) - 1)
+    else:
+        column_width = (width - gap * (len(components) - 1)) // len(components)
+        images = [
+            render_component(component, context, column_width)
+            for component in components
+        ]
+        height = max(image.height for image in images)
+
+    stack = Image.new("L", (width, height), WHITE)
+    position = 0
+
+    for image in images:
+        stack.paste(image, (0, position) if vertical else (position, 0))
+        position += (image.height if vertical else image.width) + gap
+
+    return stack
+
+
+def style_gap(style: str | dict | None, default: int = GAP) -> int:
+    """Gap (px) of a Tailwind `gap-N` class in a component style."""
+    if isinstance(style, dict):
+        style = " ".join(style.values())
+
+    for name in (style or "").split():
+        value = name.removeprefix("gap-")
+        if value != name and value.replace(".", "", 1).isdigit():
+            return round(float(value) * 4)
+
+    return default
+
+
+class Card:
+    """
+    Canvas of a card, growing as content is added below its title. The
+    card is cropped to its content when done.
+    """
+
+    def __init__(self, width: int, title: str | None = None):
+        self.width = width
+        self.image = Image.new("L", (width, CARD_MAX_HEIGHT), WHITE)
+        self.draw = ImageDraw.Draw(self.image)
+        self.y = 0
+
+        if title:
+            self.text(title.upper(), TEXT_BASE, LIGHT)
+            self.y += 8
+            self.draw.rectangle((0, self.y, width, self.y + 3), fill=LIGHTEST)
+            self.y += 4 + 16
+
+    def text(
+        self,
+        text: str,
+        size: tuple[int, int],
+        fill: int = DARK,
+        x: int = 0,
+        width: int | None = None,
+    ) -> None:
+        """Text wrapped to the given width, advancing the canvas."""
+        for line in wrap_text(text, font(size[0]), width or self.width - x):
+            draw_text(
+                self.draw, (x, self.y + size[1] // 2), line, size, fill, "lm"
+            )
+            self.y += size[1]
+
+    def done(self) -> Image:
+        return self.image.crop((0, 0, self.width, max(self.y, 1)))
+
+
+def render_tile_card(component: dict, context: RenderContext, width: int):
+    entity_id = component["entity"]
+    state = context.states.get(entity_id, {})
+    title = component.get("title")
+
+    if title is not False and (not title or title is True):
+        title = state.get("attributes", {}).get("friendly_name") or entity_id
+
+    card = Card(width)
+    card.draw.ellipse((0, 0, 39, 39), fill=LIGHTEST)
+
+    text_height = (TEXT_SM[1] if title else 0) + 20
+    card.y = max(0, (40 - text_height) // 2)
+    if title:
+        card.text(title, (TEXT_LG[0], 20), x=56)
+    card.text(
+        str(state.get("state", "?")),
+        TEXT_SM if title else TEXT_BASE,
+        LIGHT,
+        x=56,
+    )
+    card.y = max(card.y, 40)
+
+    return card.done()
+
+
+def render_entities_card(component: dict, context: RenderContext, width: int):
+    card = Card(width, component.get("title"))
+    rows = [
+        {"entity": row} if isinstance(row, str) else row
+        for row in component["entities"]
+    ]
+    rows = [row for row in rows if row.get("entity") in context.states]
+
+    if component.get("display", "list") == "grid":
+        columns = component.get("columns", 2)
+        column_width = (width - GAP * (columns - 1)) // columns
+
+        for index in range(0, len(rows), columns):
+            top, bottom = card.y, card.y
+            for column, row in enumerate(rows[index : index + columns]):
+                card.y = top
+                x = column * (column_width + GAP)
+                card.text(entity_name(row, context), TEXT_SM, LIGHT, x=x)
+                card.text(entity_value(row, context), TEXT_LG, x=x + 4)
+                if secondary := entity_secondary_info(row, context):
+                    card.text(secondary, TEXT_SM, LIGHT, x=x + 4)
+                bottom = max(bottom, card.y)
+            card.y = bottom + GAP
+        card.y -= GAP if rows else 0
+
+    else:
+        for index, row in enumerate(rows):
+            top = card.y
+            value = entity_value(row, context)
+            value_width = round(font(TEXT_SM[0]).getlength(value))
+            name_width = width - value_width - 12
+
+            card.text(entity_name(row, context), TEXT_SM, width=name_width)
+            if secondary := entity_secondary_info(row, context):
+                card.text(secondary, TEXT_SM, LIGHT, width=name_width)
+
+            draw_text(
+                card.draw,
+                (width, (top + card.y) // 2),
+                value,
+                TEXT_SM,
+                DARK,
+                anchor="rm",
+            )
+            card.y += 8 if index < len(rows) - 1 else 0
+
+    return card.done()
+
+
+def render_markdown_card(component: dict, context: RenderContext, width: int):
+    title = component.get("title")
+    content = component.get("content")
+    state = None
+
+    if not content and component.get("entity"):
+        state = context.states.get(component["entity"])
+        friendly_name = (state or {}).get("attributes", {}).get("friendly_name")
+        if not title and friendly_name:
+            title = friendly_name
+
+    if title is not False and (not title or title is True):
+        title = "Markdown"
+
+    if not content:
+        if state:
+            attribute = component.get("attribute")
+            content = state["attributes"].get(attribute) or state["state"]
+        else:
+            content = context.t("no_data")
+
+    card = Card(width, title)
+
+    for block in dedent(str(content)).strip().split("\n\n"):
+        for line in block.splitlines():
+            line = line.strip()
+            if line.startswith("#"):
+                card.text(strip_markdown(line.lstrip("#")), TEXT_BASE)
+                card.y += 2
+            elif line[:2] in ("- ", "* ", "+ "):
+                card.text("• " + strip_markdown(line[2:]), TEXT_SM)
+            else:
+                card.text(strip_markdown(line), TEXT_SM)
+        card.y += 4
+
+    return card.done()
+
+
+# Sun card path (SVG viewBox 0 0 550 150) and positions along it
+SUN_CURVES = [
+    ((5, 146), (29, 153), (73, 128), (101, 108)),
+    ((101, 108), (276, -29), (342, 23), (449, 108)),
+    ((449, 108), (473, 123), (509, 150), (545, 146)),
+]
+SUN_HORIZON_Y = 108
+SUN_RADIUS = 17
+
+
+def render_sun_card(component: dict, context: RenderContext, width: int):
+    state = context.states.get(component.get("entity", "sun.sun"))
+    title = component.get("title")
+
+    if title is not False and (not title or title is True):
+        title = context.t("sun")
+
+    card = Card(width, title)
+
+    if not state:
+        card.text(context.t("no_data"), TEXT_SM, LIGHT)
+        return card.done()
+
+    attributes = state["attributes"]
+    times = {
+        key: context.local_time(attributes[attribute])
+        for key, attribute in {
+            "sunrise": "next_rising",
+            "sunset": "next_setting",
+            "dawn": "next_dawn",
+            "dusk": "next_dusk",
+            "solar_noon": "next_noon",
+        }.items()
+    }
+
+    def labels(keys: list[str], padding: int) -> None:
+        step = (width - 2 * padding) / (len(keys) - 1)
+        for index, key in enumerate(keys):
+            x = padding + index * step
+            anchor = ("l", "m", "r")[min(index, 1) + (index == len(keys) - 1)]
+            for offset, text in enumerate(
+                (context.t(key), times[key].strftime("%H:%M"))
+            ):
+                draw_text(
+                    card.draw,
+                    (x, card.y + TEXT_SM[1] * offset + TEXT_SM[1] // 2),
+                    text,
+                    TEXT_SM,
+                    DARK,
+                    anchor=f"{anchor}m",
+                )
+        card.y += 2 * TEXT_SM[1]
+
+    labels(["sunrise", "sunset"], 24)
+
+    scale = width / 550
+    top = card.y + 8 - 48
+    draw_sun(card.image, context, times, (0, top), scale)
+    card.y = top + round(150 * scale) + 8
+
+    labels(["dawn", "solar_noon", "dusk"], 16)
+
+    return card.done()
+
+
+def draw_sun(
+    image: Image,
+    context: RenderContext,
+    times: dict[str, datetime],
+    origin: tuple[int, int],
+    scale: float,
+) -> None:
+    """Sun position along its daily path, with the passed sections filled."""
+    points = [point for curve in SUN_CURVES for point in bezier_points(curve)]
+    lengths = [0.0]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        lengths.append(lengths[-1] + ((x1 - x0) ** 2 + (y1 - y0) ** 2) ** 0.5)
+
+    def minutes(value: datetime) -> int:
+        return value.hour * 60 + value.minute
+
+    now = minutes(context.now)
+    sunrise, sunset, day_end = (
+        minutes(times["sunrise"]),
+        minutes(times["sunset"]),
+        23 * 60 + 59,
+    )
+    # Same sections as the frontend card, see `SunCard.vue`
+    position = min(now, sunrise) * 105 / max(sunrise, 1)
+    position += (
+        min(max(now - sunrise, 0), sunset - sunrise)
+        * (499 - 106)
+        / (max(sunset - sunrise, 1))
+    )
+    position += max(now - sunset, 0) * (605 - 500) / max(day_end - sunset, 1)
+
+    index = min(bisect_left(lengths, position), len(points) - 1)
+    sun_x, sun_y = points[index]
+
+    def to_image(x: float, y: float) -> tuple[float, float]:
+        return origin[0] + x * scale, origin[1] + y * scale
+
+    draw = ImageDraw.Draw(image)
+
+    # Filled sections up to the sun, dawn and dusk darker than the day
+    for curve, fill in zip(SUN_CURVES, (LIGHTER, LIGHTEST, LIGHTER)):
+        section = [point for point in bezier_points(curve) if point[0] <= sun_x]
+        if len(section) < 2:
+            continue
+        draw.polygon(
+            [
+                to_image(*point)
+                for point in [
+                    *section,
+                    (section[-1][0], SUN_HORIZON_Y),
+                    (section[0][0], SUN_HORIZON_Y),
+                ]
+            ],
+            fill=fill,
+        )
+
+    draw.line([to_image(*point) for point in points], fill=223)
+    draw.line(
+        [to_image(5, SUN_HORIZON_Y), to_image(545, SUN_HORIZON_Y)],
+        fill=51,
+    )
+
+    # The sun is only drawn above the horizon
+    if sun_y - SUN_RADIUS < SUN_HORIZON_Y:
+        left, top = map(round, to_image(sun_x - SUN_RADIUS, sun_y - SUN_RADIUS))
+        size = round(2 * SUN_RADIUS * scale) + 1
+        horizon = round(to_image(0, SUN_HORIZON_Y)[1]) - top
+
+        mask = Image.new("L", (size, size), 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, size - 1, size - 1), fill=255)
+        mask.paste(0, (0, max(horizon, 0), size, size))
+        image.paste(51, (left, top, left + size, top + size), mask=mask)
+
+
+def bezier_points(curve: tuple, steps: int = 32) -> list[tuple[float, float]]:
+    (x0, y0), (x1, y1), (x2, y2), (x3, y3) = curve
+    points = []
+
+    for step in range(steps + 1):
+        t = step / steps
+        a, b, c, d = (
+            (1 - t) ** 3,
+            3 * t * (1 - t) ** 2,
+            3 * t**2 * (1 - t),
+            t**3,
+        )
+        points.append(
+            (
+                a * x0 + b * x1 + c * x2 + d * x3,
+                a * y0 + b * y1 + c * y2 + d * y3,
+            )
+        )
+
+    return points
+
+
+CARD_RENDERERS = {
+    "sun": render_sun_card,
+    "tile": render_tile_card,
+    "entities": render_entities_card,
+    "markdown": render_markdown_card,
+}
+
+
+def entity_name(row: dict, context: RenderContext) -> str:
+    if "name" in row:
+        return str(row["name"] or "")
+    state = context.states[row["entity"]]
+    return state.get("attributes", {}).get("friendly_name") or ""
+
+
+def entity_value(row: dict, context: RenderContext) -> str:
+    """Displayed value of an entity row, as formatted by the frontend."""
+    state = context.states[row["entity"]]
+    attributes = state.get("attributes", {})
+
+    if row.get("attribute"):
+        if value := attributes.get(row["attribute"]):
+            return f"{value} {row['unit']}" if row.get("unit") else str(value)
+        return "?"
+
+    value = str(state.get("state", ""))
+
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+
+    if number is not None:
+        if row.get("precision", -1) >= 0 or attributes.get("state_class"):
+            value = f"{number:.{row.get('precision') or 0}f}"
+    elif value:
+        value = value.replace("_", " ", 1)
+        value = value[0].upper() + value[1:]
+
+    unit = row.get("unit") or attributes.get("unit_of_measurement")
+    return f"{value} {unit}" if unit else value
+
+
+def entity_secondary_info(row: dict, context: RenderContext) -> str:
+    source = row.get("secondaryInfo")
+    state = context.states[row["entity"]]
+
+    if not source:
+        return ""
+
+    if source.startswith("attribute."):
+        value = state.get("attributes", {}).get(
+            source.removeprefix("attribute.")
+        )
+        return str(value) if value else "?"
+
+    if source.startswith("sensor."):
+        sensor = context.states.get(source, {})
+        unit = sensor.get("attributes", {}).get("unit_of_measurement")
+        value = sensor.get("state", "?")
+        return f"{value} {unit}" if unit else str(value)
+
+    if source in ("last-changed", "last-updated"):
+        changed = context.local_time(state[source.replace("-", "_")])
+        return "{} {}".format(
+            format_distance((context.now - changed).total_seconds(), context),
+            context.t("ago"),
+        )
+
+    return ""
+
+
+def format_distance(seconds: float, context: RenderContext) -> str:
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if (count := round(seconds / size)) >= 1 or unit == "minute":
+            count = max(count, 1)
+            return f"{count} {context.t(unit)[count != 1]}"
+
+
+def strip_markdown(text: str) -> str:
+    """Text of inline Markdown, without emphasis and code markers."""
+    for marker in ("**", "__", "`", "*"):
+        text = text.replace(marker, "")
+    return text.strip()
+
+
+@lru_cache(maxsize=8)
+def font(size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(str(font_path), size)
+
+
+def draw_text(
+    draw: ImageDraw.ImageDraw,
+    position: tuple[float, float],
+    text: str,
+    size: tuple[int, int],
+    fill: int,
+    anchor: str = "la",
+) -> None:
+    draw.text(position, text, font=font(size[0]), fill=fill, anchor=anchor)
+
+
+def wrap_text(text: str, text_font: ImageFont.FreeTypeFont, width: int):
+    """Words of a text greedily wrapped into lines fitting `width`."""
+    lines = []
+
+    for paragraph in str(text).splitlines() or [""]:
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if line and text_font.getlength(candidate) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+
+    return lines
@@ -1,9 +1,29 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-
-from ..dependencies import get_config, get_view, get_views
-from ..models.capture import Capture, CaptureDetails, CaptureFormat
+from asyncio import shield, wait_for
+
+from fastapi import APIRouter, Depends, Response, status, HTTPException
+
+from ..dependencies import (
+    get_capture_index,
+    get_capture_scheduler,
+    get_config,
+    get_history_cache,
+    get_transcode_cache,
+    get_view,
+    get_views,
+)
+from ..history import HistoryCache
+from ..index import CaptureIndex, capture_name
+from ..models.capture import (
+    Capture,
+    CaptureDetails,
+    CaptureFormat,
+    CaptureResult,
+)
+from ..models.cache import CacheStats
 from ..models.config import Config
 from ..models.view import View
+from ..scheduler import CapturePriority, CaptureScheduler
+from ..transcode import TranscodeCache
 from ..util import get_image_details
 
 
@@ -18,6 +38,23 @@ async def config(
     return config
 
 
+@router.get("/cache", summary="Cache statistics")
+async def cache_stats(
+    transcode_cache: TranscodeCache = Depends(get_transcode_cache),
+    history_cache: HistoryCache = Depends(get_history_cache),
+    capture_scheduler: CaptureScheduler = Depends(get_capture_scheduler),
+) -> dict[str, CacheStats]:
+    stats = {
+        "variants": transcode_cache.stats(),
+        "history": history_cache.stats(),
+    }
+
+    if interceptor := capture_scheduler.interceptor:
+        stats["static"] = interceptor.stats()
+
+    return stats
+
+
 @router.get("/views", summary="List all views")
 async def list_views(
     views: list = Depends(get_views),
@@ -30,6 +67,42 @@ async def view_details(view: View = Depends(get_view)) -> View:
     return view
 
 
+@router.post(
+    "/views/{view_name}/capture",
+    summary="Capture a view",
+    responses={status.HTTP_202_ACCEPTED: {"description": "Capture started"}},
+)
+async def capture_view(
+    response: Response,
+    wait: bool = True,
+    timeout: float = None,
+    view: View = Depends(get_view),
+    config: Config = Depends(get_config),
+    capture_scheduler: CaptureScheduler = Depends(get_capture_scheduler),
+) -> list[CaptureResult] | None:
+    """
+    Capture a view immediately. Concurrent requests for the same view share
+    a single capture. Unless `wait` is false, the results (for the default
+    capture and each device profile of the view) are returned when the
+    capture completes within `timeout` seconds.
+    """
+    task = capture_scheduler.capture(
+        config, view.config, CapturePriority.on_demand
+    )
+
+    if wait:
+        try:
+            return await wait_for(
+                shield(task),
+                timeout=timeout or config.server.capture_request_timeout,
+            )
+        except TimeoutError:
+            pass
+
+    response.status_code = status.HTTP_202_ACCEPTED
+    return None
+
+
 @router.get(
     "/captures",
     name="list_all_captures",
@@ -43,27 +116,31 @@ async def view_details(view: View = Depends(get_view)) -> View:
 async def list_captures(
     view_name: str = None,
     capture_format: CaptureFormat = None,
-    views: list = Depends(get_views),
+    profile: str = None,
+    config: Config = Depends(get_config),
+    capture_index: CaptureIndex = Depends(get_capture_index),
 ) -> list[Capture]:
-    if view_name and view_name not in [view.name for view in views]:
+    """
+    Captures of configured views (newest first), or of their `profile`
+    captures. Files of views no longer configured are not listed.
+    """
+    view_names = [view.name for view in config.views]
+
+    if view_name and view_name not in view_names:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"View '{view_name}' not found",
         )
 
-    captures = []
-
-    for view in views:
-        if view_name and view.name != view_name:
-            continue
-        captures.extend(view.captures)
-
-    captures = sorted(captures, key=lambda c: c.timestamp, reverse=True)
-
-    if capture_format:
-        captures = [c for c in captures if c.format == capture_format]
+    captures = [
+        capture
+        for name in ([view_name] if view_name else view_names)
+        for capture in capture_index.captures(
+            capture_name(name, profile), capture_format
+        )
+    ]
 
-    return captures
+    return sorted(captures, key=lambda c: c.timestamp, reverse=True)
 
 
 @router.get("/captures/{filename:str}", summary="Get capture details")
@@ -74,46 +151,32 @@ async def list_captures(
 async def get_capture(
     filename: str = None,
     view_name: str = None,
-    views: list = Depends(get_views),
     config: Config = Depends(get_config),
+    capture_index: CaptureIndex = Depends(get_capture_index),
 ) -> CaptureDetails:
-    if view_name and view_name not in [view.name for view in views]:
+    if view_name and view_name not in [view.name for view in config.views]:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"View '{view_name}' not found",
         )
 
     if view_name and not filename:
-        view = next((v for v in views if v.name == view_name), None)
-        if view and view.last_capture:
-            return CaptureDetails(
-                **view.last_capture.model_dump(),
-                **get_image_details(
-                    config.server.capture_path / view.last_capture.filename
-                ),
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="No captures found for view",
-            )
+        capture = capture_index.latest(view_name)
 
-    for view in views:
-        if capture := next(
-            (c for c in view.captures if c.filename == filename), None
-        ):
-            return CaptureDetails(
-                **capture.model_dump(),
-                **get_image_details(
-                    config.server.capture_path / capture.filename
-                ),
-            )
-        else:
+        if not capture:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No captures found for view",
             )
+    else:
+        capture = capture_index.get(filename)
+
+    if not capture:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Capture not found"
+        )
 
-    raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND, detail="Capture not found"
+    return CaptureDetails(
+        **capture.model_dump(),
+        **get_image_details(config.server.capture_path / capture.filename),
     )
@@ -1,8 +1,12 @@
-from asyncio import timeout as async_timeout
+from asyncio import gather, timeout as async_timeout
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from json import loads as json_loads
+from re import match as re_match
 from time import time
+from urllib.parse import quote
 
+from aiohttp import ClientError
 from dateutil import parser as date_parser
 from dateutil.relativedelta import relativedelta
 from fastapi import (
@@ -12,39 +16,58 @@ from fastapi import (
     Path as PathParam,
     Query as QueryParam,
     Request,
+    Response,
     status,
 )
-from homeassistant_api import Client as HomeAssistantClient
 from homeassistant_api.errors import (
     EndpointNotFoundError,
+    HomeassistantAPIError,
     InternalServerError,
+    RequestTimeoutError,
     UnauthorizedError,
 )
 from loguru import logger
-from requests.exceptions import ConnectionError
 
 from ..models import homeassistant
 from ..models.server import OutputFormat
-from ..dependencies import get_homeassistant_client
-from ..socket import socket_service_call
+from ..dependencies import (
+    get_history_cache,
+    get_homeassistant_client,
+    get_state_mirror,
+)
+from ..history import HistoryCache
+from ..homeassistant import HomeAssistant, StateMirror
 from .static import templates
 
 
 router = APIRouter()
 
+ENTITY_ID_PATTERN = r"^[0-9A-Za-z\_]+\.[0-9A-Za-z\_]+$"
+
 
 @router.get("")
 async def config(
-    client: HomeAssistantClient = Depends(get_homeassistant_client),
+    ha: HomeAssistant = Depends(get_homeassistant_client),
 ) -> homeassistant.Config:
-    return _homeassistant_request(client.get_config)
+    async with _homeassistant_request(ha) as client:
+        return await client.async_get_config()
+
+
+@router.get("/mirror")
+async def mirror(
+    mirror: StateMirror = Depends(get_state_mirror),
+) -> homeassistant.StateMirrorStatus:
+    return mirror.status()
 
 
 @router.get("/entity/{entity_id}")
 async def entity(
     request: Request,
-    client: HomeAssistantClient = Depends(get_homeassistant_client),
-    entity_id: str = PathParam(regex=r"^[0-9A-Za-z\_]+\.[0-9A-Za-z\_]+$"),
+    response: Response,
+    ha: HomeAssistant = Depends(get_homeassistant_client),
+    mirror: StateMirror = Depends(get_state_mirror),
+    history_cache: HistoryCache = Depends(get_history_cache),
+    entity_id: str = PathParam(regex=ENTITY_ID_PATTERN),
     history: bool = False,
     period_start: datetime = None,
     period_end: datetime = None,
@@ -59,32 +82,17 @@ async def entity(
     )
     start_time = time()
 
-    entity = _homeassistant_request(client.get_entity, entity_id=entity_id)
-
-    output = {
-        **entity.state.dict(),
-    }
-
-    if history:
-        now = datetime.now()
-
-        if not period_start:
-            period_start = now - timedelta(days=1)
-        if not period_end:
-            period_end = now
-
-        history_records = entity.get_history(
-            start_timestamp=period_start,
-            end_timestamp=period_end,
-            significant_changes_only=significant_changes_only,
-        )
-
-        output = {
-            **output,
-            "history": history_records.states if history_records else [],
-            "history_start": period_start.isoformat(timespec="seconds"),
-            "history_end": period_end.isoformat(timespec="seconds"),
-        }
+    output, source = await _entity(
+        ha,
+        mirror,
+        history_cache,
+        entity_id,
+        history=history,
+        period_start=period_start,
+        period_end=period_end,
+        significant_changes_only=significant_changes_only,
+    )
+    response.headers["X-State-Source"] = source
 
     logger.debug(f"> Request duration: {round(time() - start_time, 3)} s.")
 
@@ -100,13 +108,48 @@ async def entity(
     return output
 
 
+@router.get("/entities")
+async def entities(
+    ha: HomeAssistant = Depends(get_homeassistant_client),
+    mirror: StateMirror = Depends(get_state_mirror),
+    history_cache: HistoryCache = Depends(get_history_cache),
+    entity_id: list[str] = QueryParam(),
+    history: bool = False,
+    period_start: datetime = None,
+    period_end: datetime = None,
+    significant_changes_only: bool = False,
+) -> homeassistant.Entities:
+    return await _entities(
+        ha,
+        mirror,
+        history_cache,
+        homeassistant.EntitiesRequest(
+            entity_ids=entity_id,
+            history=history,
+            period_start=period_start,
+            period_end=period_end,
+            significant_changes_only=significant_changes_only,
+        ),
+    )
+
+
+@router.post("/entities")
+async def post_entities(
+    entities_request: homeassistant.EntitiesRequest,
+    ha: HomeAssistant = Depends(get_homeassistant_client),
+    mirror: StateMirror = Depends(get_state_mirror),
+    history_cache: HistoryCache = Depends(get_history_cache),
+) -> homeassistant.Entities:
+    return await _entities(ha, mirror, history_cache, entities_request)
+
+
 @router.get("/service/{domain}/{service}")
 async def entity(
     domain: str,
     service: str,
     target: str,
     data: str = None,
-    client: HomeAssistantClient = Depends(get_homeassistant_client),
+    ha: HomeAssistant = Depends(get_homeassistant_client),
 ):
     """
     The REST API endpoint for calling services does not currently support
@@ -119,21 +162,22 @@ async def entity(
     """
 
     try:
-        timeout = 2
-
-        async with async_timeout(timeout):
-            return await socket_service_call(
-                ha_api_url=client.api_url,
-                ha_token=client.token,
-                domain=domain,
-                service=service,
-                target={"entity_id": target},
-                service_data=json_loads(data) if data else {},
+        async with async_timeout(ha.timeout):
+            response = await ha.socket.call(
+                {
+                    "type": "call_service",
+                    "domain": domain,
+                    "service": service,
+                    "service_data": json_loads(data) if data else {},
+                    "target": {"entity_id": target},
+                    "return_response": True,
+                }
             )
+            return response["response"]
     except TimeoutError as e:
         raise HTTPException(
             status_code=status.HTTP_408_REQUEST_TIMEOUT,
-            detail=f"Home Assistant: Timeout ({timeout} s.)",
+            detail=f"Home Assistant: Timeout ({ha.timeout} s.)",
         )
     except Exception as e:
         raise HTTPException(
@@ -144,16 +188,16 @@ async def entity(
 
 @router.get("/calendar")
 async def calendar(
-    client: HomeAssistantClient = Depends(get_homeassistant_client),
+    ha: HomeAssistant = Depends(get_homeassistant_client),
     calendar: list[str] = QueryParam(None),
 ) -> list[homeassistant.CalendarEvent]:
     now = datetime.now()
-    calendar_events = []
 
-    calendars = {
-        c["entity_id"]: c["name"]
-        for c in _homeassistant_request(client.request, "calendars")
-    }
+    async with _homeassistant_request(ha) as client:
+        calendars = {
+            c["entity_id"]: c["name"]
+            for c in await client.async_request("calendars")
+        }
 
     if calendar and len(calendar) > 0:
         calendars = {
@@ -162,27 +206,174 @@ async def calendar(
             if entity_id in calendar
         }
 
-    for entity_id, name in calendars.items():
+    async def fetch_events(entity_id: str, name: str) -> list[dict]:
+        async with _homeassistant_request(ha) as client:
+            try:
+                events = await client.async_request(
+                    f"calendars/{entity_id}",
+                    params={
+                        "start": now.isoformat(),
+                        "end": (now + relativedelta(months=3)).isoformat(),
+                    },
+                )
+            except InternalServerError:
+                return []
+
+        return [
+            {**event, "entity_id": entity_id, "calendar_name": name}
+            for event in events
+        ]
+
+    # Calendars are fetched concurrently, bounded by the client
+    calendar_events = await gather(
+        *(
+            fetch_events(entity_id, name)
+            for entity_id, name in calendars.items()
+        )
+    )
+    return [event for events in calendar_events for event in events]
+
+
+async def _entity(
+    ha: HomeAssistant,
+    mirror: StateMirror,
+    history_cache: HistoryCache,
+    entity_id: str,
+    history: bool = False,
+    period_start: datetime = None,
+    period_end: datetime = None,
+    significant_changes_only: bool = False,
+) -> tuple[dict, str]:
+    """State of an entity, with its history if requested, and its source."""
+    if state := mirror.get(entity_id):
+        output, source = state, "mirror"
+    else:
+        async with _homeassistant_request(ha) as client:
+            entity = await client.async_get_entity(entity_id=entity_id)
+
+        output, source = entity.state.dict(), "rest"
+
+    if history:
+        now = datetime.now().astimezone()
+        # Naive datetimes are in local time
+        period_start = (period_start or now - timedelta(days=1)).astimezone()
+        period_end = (period_end or now).astimezone()
+
+        async def fetch(start: datetime, end: datetime) -> list[dict]:
+            return await _entity_history(
+                ha, entity_id, start, end, significant_changes_only
+            )
+
+        output = {
+            **output,
+            "history": await history_cache.get(
+                entity_id,
+                period_start,
+                period_end,
+                fetch,
+                significant_changes_only=significant_changes_only,
+            ),
+            "history_start": period_start.isoformat(timespec="seconds"),
+            "history_end": period_end.isoformat(timespec="seconds"),
+        }
+
+    return output, source
+
+
+async def _entity_history(
+    ha: HomeAssistant,
+    entity_id: str,
+    start: datetime,
+    end: datetime,
+    significant_changes_only: bool = False,
+) -> list[dict]:
+    """States of an entity from `start` to `end`, as sent by Home Assistant."""
+    params = {"filter_entity_id": entity_id, "end_time": end.isoformat()}
+
+    if significant_changes_only:
+        params["significant_changes_only"] = ""
+
+    async with _homeassistant_request(ha) as client:
+        history = await client.async_request(
+            f"history/period/{quote(start.isoformat())}", params=params
+        )
+
+    return history[0] if history else []
+
+
+async def _entities(
+    ha: HomeAssistant,
+    mirror: StateMirror,
+    history_cache: HistoryCache,
+    entities_request: homeassistant.EntitiesRequest,
+) -> dict:
+    """
+    States of many entities, fetched concurrently (bounded by the client).
+    Entities that could not be fetched are reported in `errors`.
+    """
+    entity_ids = list(dict.fromkeys(entities_request.entity_ids))
+    logger.info(
+        "Fetching entity data for {} (history={})".format(
+            ", ".join(entity_ids), entities_request.history
+        )
+    )
+    start_time = time()
+
+    async def fetch(entity_id: str) -> dict | homeassistant.EntityError:
+        if not re_match(ENTITY_ID_PATTERN, entity_id):
+            return homeassistant.EntityError(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Invalid entity id '{entity_id}'",
+            )
+
         try:
-            for event in client.request(
-                f"calendars/{entity_id}",
-                params={
-                    "start": now.isoformat(),
-                    "end": (now + relativedelta(months=3)).isoformat(),
-                },
-            ):
-                event["entity_id"] = entity_id
-                event["calendar_name"] = name
-                calendar_events.append(event)
-        except InternalServerError:
-            pass
-
-    return calendar_events
-
-
-def _homeassistant_request(method, *args, **kwargs):
+            output, _ = await _entity(
+                ha,
+                mirror,
+                history_cache,
+                entity_id,
+                history=entities_request.history,
+                period_start=entities_request.period_start,
+                period_end=entities_request.period_end,
+                significant_changes_only=(
+                    entities_request.significant_changes_only
+                ),
+            )
+            return output
+        except HTTPException as e:
+            return homeassistant.EntityError(
+                status_code=e.status_code, detail=e.detail
+            )
+        except Exception as e:
+            logger.opt(exception=e).error(f"Could not fetch {entity_id}")
+            return homeassistant.EntityError(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Home Assistant: {e}",
+            )
+
+    results = await gather(*(fetch(entity_id) for entity_id in entity_ids))
+
+    logger.debug(f"> Request duration: {round(time() - start_time, 3)} s.")
+
+    return {
+        "entities": {
+            entity_id: result
+            for entity_id, result in zip(entity_ids, results)
+            if not isinstance(result, homeassistant.EntityError)
+        },
+        "errors": {
+            entity_id: result
+            for entity_id, result in zip(entity_ids, results)
+            if isinstance(result, homeassistant.EntityError)
+        },
+    }
+
+
+@asynccontextmanager
+async def _homeassistant_request(ha: HomeAssistant):
     try:
-        return method(*args, **kwargs)
+        async with ha.session() as client:
+            yield client
     except UnauthorizedError as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -193,8 +384,18 @@ def _homeassistant_request(method, *args, **kwargs):
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Home Assistant: {e} (endpoint not found)",
         )
-    except ConnectionError:
+    except ClientError:
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
             detail="Could not connect to Home Assistant",
         )
+    except (TimeoutError, RequestTimeoutError):
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Home Assistant: Timeout ({ha.timeout} s.)",
+        )
+    except HomeassistantAPIError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Home Assistant: {e}",
+        )
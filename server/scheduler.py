@@ -0,0 +1,208 @@
+import asyncio
+from enum import IntEnum
+from itertools import count
+
+from loguru import logger
+
+from .browser import BrowserPool
+from .capture import capture_screenshot, create_executor
+from .homeassistant import StateMirror
+from .index import CaptureIndex
+from .interceptor import RequestInterceptor
+from .models.capture import CaptureResult
+from .models.config import Config, ViewConfig
+from .models.server import ServerConfig
+
+
+class CapturePriority(IntEnum):
+    on_demand = 0
+    scheduled = 1
+
+
+class PrioritySemaphore:
+    """
+    Semaphore handing free slots to the waiter with the lowest priority.
+    Waiters are identified by a key so their priority can be raised later.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: dict[str, tuple[int, int, asyncio.Future]] = {}
+        self._sequence = count()
+
+    async def acquire(self, key: str, priority: int) -> None:
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[key] = (priority, next(self._sequence), waiter)
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over before cancellation, pass it on
+                self.release()
+            raise
+        finally:
+            if self._waiters.get(key, (None, None, None))[2] is waiter:
+                del self._waiters[key]
+
+    def release(self) -> None:
+        self._value += 1
+
+        while self._value > 0 and self._waiters:
+            key = min(self._waiters, key=lambda k: self._waiters[k][:2])
+            _, _, waiter = self._waiters.pop(key)
+
+            if not waiter.done():
+                self._value -= 1
+                waiter.set_result(None)
+
+    def prioritize(self, key: str, priority: int) -> None:
+        if entry := self._waiters.get(key):
+            self._waiters[key] = (min(entry[0], priority), *entry[1:])
+
+
+class CaptureScheduler:
+    """
+    Runs captures through `capture_screenshot` with bounded concurrency.
+
+    Concurrent requests for the same view share one in-flight capture
+    (single-flight), and on-demand captures are started before scheduled
+    ones waiting for a free slot.
+    """
+
+    def __init__(
+        self, server_config: ServerConfig, capture_index: CaptureIndex
+    ):
+        self.server_config = server_config
+        self.capture_index = capture_index
+        self.interceptor: RequestInterceptor | None = None
+        self.state_mirror: StateMirror | None = None
+        self.browser_pool = BrowserPool(
+            max_captures=server_config.capture_browser_max_captures,
+            max_rss=server_config.capture_browser_max_rss,
+        )
+        self.executor = create_executor(server_config)
+
+        self._semaphore = PrioritySemaphore(server_config.capture_concurrency)
+        self._in_flight: dict[str, asyncio.Task] = {}
+
+    async def start(
+        self, app=None, state_mirror: StateMirror | None = None
+    ) -> None:
+        """
+        Start the browser. Given the ASGI `app` serving the dashboard,
+        capture pages are served in-process through a `RequestInterceptor`.
+        Views rendered natively are drawn with states of `state_mirror`.
+        """
+        self.state_mirror = state_mirror
+
+        if app and self.server_config.capture_intercept_requests:
+            self.interceptor = RequestInterceptor(
+                app,
+                origin=self.origin,
+                static_path=self.server_config.static_path,
+                block_urls=self.server_config.capture_block_urls,
+            )
+            self.browser_pool.route_handler = self.interceptor.handle
+
+        await self.browser_pool.start()
+
+    async def stop(self) -> None:
+        for task in self._in_flight.values():
+            task.cancel()
+
+        await self.browser_pool.stop()
+        self.executor.shutdown(cancel_futures=True)
+
+    @property
+    def origin(self) -> str:
+        return f"http://localhost:{self.server_config.port}"
+
+    def is_capturing(self, view_name: str) -> bool:
+        return view_name in self._in_flight
+
+    def capture(
+        self,
+        config: Config,
+        view: ViewConfig,
+        priority: CapturePriority = CapturePriority.scheduled,
+    ) -> asyncio.Task:
+        """
+        Start capturing a view, or join the capture already in flight.
+        The task results in one `CaptureResult` per output (the default
+        capture config and each device profile of the view).
+        The returned task should be awaited through `asyncio.shield` by
+        callers that may be cancelled.
+        """
+        if task := self._in_flight.get(view.name):
+            self._semaphore.prioritize(view.name, priority)
+            return task
+
+        task = asyncio.create_task(self._capture(config, view, priority))
+        self._in_flight[view.name] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(view.name, None))
+
+        return task
+
+    async def capture_views(
+        self,
+        config: Config,
+        views: list[ViewConfig],
+        priority: CapturePriority = CapturePriority.scheduled,
+    ) -> list[CaptureResult]:
+        """Capture multiple views, a failing view does not affect others."""
+        results = await asyncio.gather(
+            *(
+                asyncio.shield(self.capture(config, view, priority))
+                for view in views
+            ),
+            return_exceptions=True,
+        )
+
+        for view, result in zip(views, results):
+            if isinstance(result, BaseException):
+                logger.opt(exception=result).error(
+                    f"Capture of view '{view.name}' failed"
+                )
+
+        return [
+            view_result
+            for view, result in zip(views, results)
+            for view_result in (
+                [
+                    CaptureResult(
+                        view_name=view.name, success=False, error=str(result)
+                    )
+                ]
+                if isinstance(result, BaseException)
+                else result
+            )
+        ]
+
+    async def _capture(
+        self, config: Config, view: ViewConfig, priority: CapturePriority
+    ) -> list[CaptureResult]:
+        await self._semaphore.acquire(view.name, priority)
+
+        try:
+            target_url = f"{self.origin}/{view.name}"
+            logger.info(
+                "Capturing view '{}' from {} (priority={})".format(
+                    view.name, target_url, priority.name
+                )
+            )
+            return await capture_screenshot(
+                config=config,
+                url=target_url,
+                view=view,
+                browser_pool=self.browser_pool,
+                executor=self.executor,
+                capture_index=self.capture_index,
+                state_mirror=self.state_mirror,
+            )
+        finally:
+            self._semaphore.release()
@@ -1,56 +1,207 @@
+import asyncio
 import json
-from random import randint
+from itertools import count
+from typing import Awaitable, Callable
 
+from loguru import logger
 from websockets import connect, ConnectionClosed
 
 
-async def socket_service_call(
-    ha_api_url,
-    ha_token,
-    domain,
-    service,
-    target={},
-    service_data={},
-):
-    uri = "ws://{}websocket".format(ha_api_url.split("://")[1])
-    call_id = randint(100, 200)
+class HomeAssistantSocketError(Exception):
+    pass
+
+
+def _websocket_uri(ha_api_url: str) -> str:
+    scheme, address = ha_api_url.split("://")
+    return "{}://{}websocket".format(
+        "wss" if scheme == "https" else "ws", address
+    )
+
+
+async def _authenticate(websocket, ha_token: str) -> None:
+    async for data in websocket:
+        data = json.loads(data)
+
+        if data["type"] == "auth_required":
+            await websocket.send(
+                json.dumps(
+                    {
+                        "type": "auth",
+                        "access_token": ha_token,
+                    }
+                )
+            )
+        elif data["type"] == "auth_invalid":
+            raise Exception(data["message"])
+        elif data["type"] == "auth_ok":
+            return
+
+    raise ConnectionError("Websocket connection closed before auth_ok")
+
+
+class HomeAssistantSocket:
+    """
+    Long-lived, authenticated websocket connection to Home Assistant.
+
+    Messages are sent with increasing ids and their responses are matched
+    through a table of pending requests, so any number of calls can be in
+    flight at once. The connection is opened on first use, checked with a
+    ping every `heartbeat` seconds and reopened with backoff when lost.
+    Subscriptions end with their connection, callbacks registered with
+    `on_connect` are run on every (re)connection to renew them.
+    """
+
+    def __init__(self, ha_api_url: str, ha_token: str, heartbeat: float = 30):
+        self.uri = _websocket_uri(ha_api_url)
+        self.ha_token = ha_token
+        self.heartbeat = heartbeat
+
+        self._ids = count(1)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._subscriptions: dict[int, Callable[[dict], None]] = {}
+        self._connect_callbacks: list[Callable[[], Awaitable[None]]] = []
+        self._callback_tasks: set[asyncio.Task] = set()
+        self._websocket = None
+        self._connected = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+        # Incremented on every connection, to tell connections apart
+        self.connection_count = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    def on_connect(self, callback: Callable[[], Awaitable[None]]) -> None:
+        self._connect_callbacks.append(callback)
+
+    async def call(
+        self, message: dict, on_event: Callable[[dict], None] | None = None
+    ) -> dict | None:
+        """
+        Send a command and wait for its result, raising
+        `HomeAssistantSocketError` when it fails. Callers are expected to
+        bound the wait, i.e. using `asyncio.timeout`.
+        Events of a subscription command are passed to `on_event` until the
+        connection closes.
+        """
+        self.start()
+        await self._connected.wait()
+
+        # The connection may have closed since it was signalled
+        if not (websocket := self._websocket):
+            raise ConnectionError("Websocket connection closed")
+
+        # Registered before sending, to be failed if the connection closes
+        message_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+
+        if on_event:
+            self._subscriptions[message_id] = on_event
 
-    async with connect(uri) as websocket:
         try:
-            async for data in websocket:
-                data = json.loads(data)
-
-                if data["type"] == "auth_required":
-                    await websocket.send(
-                        json.dumps(
-                            {
-                                "type": "auth",
-                                "access_token": ha_token,
-                            }
-                        )
-                    )
-                elif data["type"] == "auth_invalid":
-                    raise Exception(data["message"])
-                elif data["type"] == "auth_ok":
-                    await websocket.send(
-                        json.dumps(
-                            {
-                                "id": call_id,
-                                "type": "call_service",
-                                "domain": domain,
-                                "service": service,
-                                "service_data": service_data,
-                                "target": target,
-                                "return_response": True,
-                            }
-                        )
-                    )
-                elif data["type"] == "result" and data["id"] == call_id:
-                    if not data["success"]:
-                        raise Exception(
-                            f"{data['error']['code']}: {data['error']['message']}"
+            try:
+                await websocket.send(json.dumps({**message, "id": message_id}))
+            except ConnectionClosed as e:
+                raise ConnectionError("Websocket connection closed") from e
+
+            return await future
+        except BaseException:
+            self._subscriptions.pop(message_id, None)
+            raise
+        finally:
+            self._pending.pop(message_id, None)
+
+    async def reconnect(self) -> None:
+        if self._websocket:
+            await self._websocket.close()
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        backoff = 1
+
+        while True:
+            try:
+                async with connect(self.uri) as websocket:
+                    await _authenticate(websocket, self.ha_token)
+                    logger.info("Connected to Home Assistant websocket")
+
+                    self._websocket = websocket
+                    self.connection_count += 1
+                    self._connected.set()
+                    backoff = 1
+
+                    for callback in self._connect_callbacks:
+                        task = asyncio.create_task(callback())
+                        self._callback_tasks.add(task)
+                        task.add_done_callback(self._callback_tasks.discard)
+
+                    heartbeat = asyncio.create_task(self._heartbeat(websocket))
+                    try:
+                        async for data in websocket:
+                            self._dispatch(json.loads(data))
+                    finally:
+                        heartbeat.cancel()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Home Assistant websocket failed: {e}")
+            finally:
+                self._connected.clear()
+                self._websocket = None
+                self._subscriptions.clear()
+
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(
+                            ConnectionError("Websocket connection closed")
                         )
-                    return data["result"]["response"]
 
-        except ConnectionClosed as e:
-            raise Exception(f"Websocket connection closed: {e}")
+            logger.info(f"Reconnecting to Home Assistant in {backoff} s.")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    async def _heartbeat(self, websocket) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+
+            try:
+                async with asyncio.timeout(self.heartbeat):
+                    await self.call({"type": "ping"})
+            except Exception as e:
+                logger.warning(f"Home Assistant websocket unresponsive: {e}")
+                await websocket.close()
+                return
+
+    def _dispatch(self, data: dict) -> None:
+        if data.get("type") == "event":
+            if callback := self._subscriptions.get(data.get("id")):
+                callback(data["event"])
+            return
+
+        future = self._pending.get(data.get("id"))
+
+        if not future or future.done():
+            return
+
+        if data["type"] == "pong":
+            future.set_result(None)
+        elif data["type"] == "result":
+            if data["success"]:
+                future.set_result(data.get("result"))
+            else:
+                future.set_exception(
+                    HomeAssistantSocketError(
+                        f"{data['error']['code']}: {data['error']['message']}"
+                    )
+                )
@@ -0,0 +1,78 @@
+import asyncio
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from .models.cache import CacheStats
+
+
+class TranscodeCache:
+    """
+    Size-bounded LRU cache of transcoded captures.
+
+    Concurrent misses for the same key share one transcoding, so a fleet of
+    devices requesting a new variant at once only renders it once.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self._pending: dict[str, asyncio.Task] = {}
+
+    async def get(
+        self, key: str, render: Callable[[], Awaitable[bytes]]
+    ) -> tuple[bytes, bool]:
+        """Cached data for `key` (rendering it on a miss), and if it was a hit."""
+        if (data := self._entries.get(key)) is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data, True
+
+        if task := self._pending.get(key):
+            self.hits += 1
+            return await asyncio.shield(task), True
+
+        self.misses += 1
+        task = asyncio.ensure_future(render())
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._done(key, task))
+
+        return await asyncio.shield(task), False
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            entries=len(self._entries),
+            size=self._size,
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        self._pending.pop(key, None)
+
+        if task.cancelled() or task.exception():
+            return
+
+        data = task.result()
+
+        if len(data) > self.max_size:
+            return
+
+        self._entries[key] = data
+        self._size += len(data)
+
+        while self._size > self.max_size:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            logger.debug(f"Evicted variant {evicted_key} from transcode cache")
+
+
+def variant_key(*parts: str) -> str:
+    return blake2b(":".join(parts).encode(), digest_size=16).hexdigest()
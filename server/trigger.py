@@ -0,0 +1,153 @@
+import asyncio
+import re
+from fnmatch import fnmatch
+from time import time
+
+from loguru import logger
+
+from .homeassistant import StateMirror
+from .models.config import Config, ViewConfig
+from .scheduler import CaptureScheduler
+
+
+ENTITY_ID_PATTERN = re.compile(r"^[a-z0-9_]+\.[a-z0-9_]+$")
+
+# Entities used by components when none is configured
+DEFAULT_ENTITIES = {
+    "sun": ["sun.sun"],
+    "transmission": ["sensor.transmission_total_torrents"],
+    "calendar": ["calendar.*"],
+}
+
+
+def component_entities(components: list[dict]) -> set[str]:
+    """
+    Entity ids (or `domain.*` patterns) referenced by a component tree.
+    Any string value shaped like an entity id is considered a reference.
+    """
+    entities = set()
+
+    def walk(value, component_type: str | None = None) -> None:
+        if isinstance(value, dict):
+            if component_type := value.get("type", component_type):
+                entities.update(DEFAULT_ENTITIES.get(component_type, []))
+            for item in value.values():
+                walk(item, component_type)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item, component_type)
+        elif isinstance(value, str) and ENTITY_ID_PATTERN.match(value):
+            if not value.startswith("attribute."):
+                entities.add(value)
+
+    walk(components)
+
+    # Explicitly configured calendars replace the "all calendars" default
+    if any(e.startswith("calendar.") for e in entities - {"calendar.*"}):
+        entities.discard("calendar.*")
+
+    return entities
+
+
+class EventCaptureTrigger:
+    """
+    Captures views when entities they reference change state.
+
+    Receives `state_changed` events from the state mirror, which is kept
+    subscribed across reconnections, and schedules a capture of each
+    affected view `debounce` seconds after the first change, but no sooner
+    than `min_interval` seconds after its previous capture.
+    Changes arriving while a capture is pending are coalesced into it.
+    """
+
+    def __init__(
+        self,
+        capture_scheduler: CaptureScheduler,
+        debounce: float,
+        min_interval: float,
+    ):
+        self.capture_scheduler = capture_scheduler
+        self.debounce = debounce
+        self.min_interval = min_interval
+
+        self._config: Config | None = None
+        self._views: dict[str, ViewConfig] = {}
+        self._entities: dict[str, set[str]] = {}
+        self._pending: dict[str, asyncio.Task] = {}
+        self._last_capture: dict[str, float] = {}
+
+    def start(
+        self,
+        config: Config,
+        views: list[ViewConfig],
+        state_mirror: StateMirror,
+    ) -> None:
+        self._config = config
+        self._views = {view.name: view for view in views}
+        self._entities = {
+            view.name: component_entities(view.components) for view in views
+        }
+
+        for view_name, entities in self._entities.items():
+            logger.info(
+                "View '{}' is captured on changes to: {}".format(
+                    view_name, ", ".join(sorted(entities)) or "(none)"
+                )
+            )
+
+        state_mirror.on_change(self._on_event)
+
+    async def stop(self) -> None:
+        # The mirror keeps passing events, ignore them
+        self._entities = {}
+
+        for task in self._pending.values():
+            task.cancel()
+
+    def views_for_entity(self, entity_id: str) -> list[str]:
+        return [
+            view_name
+            for view_name, entities in self._entities.items()
+            if any(fnmatch(entity_id, entity) for entity in entities)
+        ]
+
+    def _on_event(self, event: dict) -> None:
+        entity_id = event.get("data", {}).get("entity_id")
+
+        for view_name in self.views_for_entity(entity_id or ""):
+            self._schedule(self._config, self._views[view_name], entity_id)
+
+    def _schedule(self, config: Config, view: ViewConfig, entity_id: str):
+        if view.name in self._pending:
+            return
+
+        delay = max(
+            self.debounce,
+            self._last_capture.get(view.name, 0) + self.min_interval - time(),
+        )
+        logger.debug(
+            "State of {} changed, capturing view '{}' in {} s.".format(
+                entity_id, view.name, round(delay, 1)
+            )
+        )
+
+        self._pending[view.name] = asyncio.create_task(
+            self._capture(config, view, delay)
+        )
+
+    async def _capture(self, config: Config, view: ViewConfig, delay: float):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._pending.pop(view.name, None)
+
+        self._last_capture[view.name] = time()
+        results = await asyncio.shield(
+            self.capture_scheduler.capture(config, view)
+        )
+
+        for result in results:
+            if not result.success:
+                logger.warning(
+                    f"Capture of view '{view.name}' failed: {result.error}"
+                )
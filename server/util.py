@@ -3,15 +3,21 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import os
 from asyncio import ensure_future
-from functools import wraps
+from email.utils import parsedate_to_datetime
+from functools import lru_cache, wraps
+from hashlib import blake2b
 from pathlib import Path
+from tempfile import NamedTemporaryFile
 from traceback import format_exception
 from typing import Any, Callable, Coroutine, Union
 
 from starlette.concurrency import run_in_threadpool
 from PIL import Image
 
+from .framebuffer import HEADER, decode_framebuffer_header
+
 
 NoArgsNoReturnFuncT = Callable[[], None]
 NoArgsNoReturnAsyncFuncT = Callable[[], Coroutine[Any, Any, None]]
@@ -20,6 +26,10 @@ NoArgsNoReturnDecorator = Callable[
     NoArgsNoReturnAsyncFuncT,
 ]
 
+# Read once at startup, as the umask can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
 
 def repeat_every(
     *,
@@ -125,6 +135,9 @@ def get_bit_depth(image: Image.Image) -> int:
 
 def get_image_details(image_path: Path) -> dict[str, Any]:
     """Get detailed information about an image file."""
+    if image_path.suffix == ".raw":
+        return get_framebuffer_details(image_path)
+
     with Image.open(image_path) as image:
         details = {
             "file_size": image_path.stat().st_size,
@@ -140,3 +153,101 @@ def get_image_details(image_path: Path) -> dict[str, Any]:
             "compression": image.info.get("compression"),
         }
     return details
+
+
+def get_framebuffer_details(image_path: Path) -> dict[str, Any]:
+    """Get detailed information about a packed framebuffer file."""
+    with open(image_path, "rb") as file:
+        header = decode_framebuffer_header(file.read(HEADER.size))
+
+    if not header:
+        raise ValueError(f"Invalid framebuffer file `{image_path}`")
+
+    return {
+        "file_size": image_path.stat().st_size,
+        "mime_type": "application/octet-stream",
+        "resolution": (header["width"], header["height"]),
+        "mode": "1" if header["bits"] == 1 else "L",
+        "bit_depth": header["bits"],
+        "has_transparency": False,
+        "compression": "rle" if header["rle"] else None,
+    }
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """
+    Write data to a temporary file next to `path` and rename it into place,
+    so that readers never see a partially written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False
+    ) as tmp_file:
+        tmp_path = Path(tmp_file.name)
+
+        try:
+            # Temporary files are private, published files get the
+            # permissions of files created with `open`
+            os.chmod(tmp_file.fileno(), 0o666 & ~UMASK)
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    try:
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def image_hash(image: Image.Image) -> str:
+    """Hash of the decoded pixel data, mode and size of an image."""
+    digest = blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+
+    if image.mode == "P":
+        digest.update(bytes(image.getpalette() or []))
+
+    return digest.hexdigest()
+
+
+def file_etag(path: Path) -> str:
+    """Strong ETag derived from the content of a file."""
+    file_stat = path.stat()
+    return _file_etag(path, file_stat.st_mtime_ns, file_stat.st_size)
+
+
+@lru_cache(maxsize=256)
+def _file_etag(path: Path, mtime_ns: int, size: int) -> str:
+    # Files are published atomically, so (path, mtime, size) identifies content
+    digest = blake2b(path.read_bytes(), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def is_not_modified(request_headers, response_headers) -> bool:
+    """
+    Evaluate `If-None-Match` and `If-Modified-Since` request headers against
+    the `ETag` and `Last-Modified` response headers (RFC 9110, 13.2.2).
+    """
+    if if_none_match := request_headers.get("if-none-match"):
+        etag = response_headers.get("ETag", "").removeprefix("W/")
+        return if_none_match.strip() == "*" or etag in [
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        ]
+
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = response_headers.get("Last-Modified")
+
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(
+                last_modified
+            ) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    return False